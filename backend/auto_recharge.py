@@ -24,11 +24,14 @@ from eth_account import Account
 from dotenv import load_dotenv
 import httpx
 
+from rpc_pool import make_web3
+
 # 加载环境变量
 load_dotenv()
 
 # 配置
 RPC_URL = os.getenv("RPC_URL", "https://testnet-rpc.monad.xyz")
+RPC_URLS = [u.strip() for u in os.getenv("RPC_URLS", "").split(",") if u.strip()]  # 备用 RPC 节点（逗号分隔）
 CHAIN_ID = int(os.getenv("CHAIN_ID", "10143"))
 PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
 TRANSIT_WALLET = os.getenv("TRANSIT_WALLET", "")
@@ -110,7 +113,7 @@ def send_mon_payment(
     """
     try:
         # 初始化 Web3
-        w3 = Web3(Web3.HTTPProvider(RPC_URL))
+        w3 = make_web3(RPC_URL, RPC_URLS)
         
         if not w3.is_connected():
             return {
@@ -0,0 +1,234 @@
+"""
+热点账户余额分片
+
+一个高频用户的所有请求都在同一行 user_balances 上执行
+UPDATE ... WHERE balance >= :amount，行锁把该用户的扣费完全串行化（每次扣费至少一次提交的耗时）。
+对配置的热点用户，把余额拆到 user_balance_shards 的 K 个子行：
+
+- 余额 = user_balances.balance（主行）+ 各分片之和
+- 扣费：从随机分片开始依次尝试条件 UPDATE，每次尝试单独提交（不累积行锁）；
+  分片都不够时尝试主行，仍不够时重新分配一次再重试。同一用户的这种"就地"重新分配
+  每 inline_rebalance_interval 秒最多一次，其余请求只唤醒后台任务，避免余额不足的请求
+  每次都锁住全部分片
+- 重新分配的加锁顺序固定为：主行 → 补齐分片 → 分片按主键，同一用户的重新分配在主行上排队，
+  不会出现两个事务各持分片共享锁再互相等待排他锁的死锁
+- 充值照常加到主行，由后台任务定期把主行与分片的资金重新均分到各分片
+- 不再配置为热点的用户，启动时把分片资金合并回主行
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Iterable, Optional
+
+import metrics
+import queries
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedBalances:
+    """热点用户的分片余额扣费与后台重新分配"""
+
+    def __init__(
+        self,
+        session_factory,
+        shards: int = 0,
+        users: Iterable[str] = (),
+        rebalance_interval: float = 5.0,
+        inline_rebalance_interval: float = 1.0,
+    ):
+        self.session_factory = session_factory
+        self.shards = shards
+        self.users = set(users) if shards > 1 else set()
+        self.rebalance_interval = rebalance_interval
+        self.inline_rebalance_interval = inline_rebalance_interval
+        self._task = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # 用户 -> 上次就地重新分配的时间（monotonic）
+        self._last_inline: dict[str, float] = {}
+        self._inline_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.users)
+
+    @property
+    def select_balance(self):
+        """余额查询语句：开启分片时需要加上分片之和"""
+        return queries.SELECT_TOTAL_BALANCE if self.enabled else queries.SELECT_BALANCE
+
+    def is_sharded(self, user_address: str) -> bool:
+        return user_address in self.users
+
+    # ---------- 扣费 ----------
+
+    def _debit_any_shard(self, db, user_address: str, amount: int) -> bool:
+        """从随机分片开始依次尝试条件扣费"""
+        start = random.randrange(self.shards)
+        for i in range(self.shards):
+            metrics.BALANCE_SHARD_DEBIT_ATTEMPTS.inc()
+            rowcount = db.execute(
+                queries.DEBIT_SHARD, {"u": user_address, "s": (start + i) % self.shards, "amount": amount}
+            ).rowcount
+            db.commit()
+            if rowcount == 1:
+                return True
+        return False
+
+    def debit(self, db, user_address: str, amount: int) -> bool:
+        """
+        从分片扣费（每次条件 UPDATE 单独提交）
+
+        Returns:
+            是否扣费成功；False 表示总余额不足
+        """
+        if self._debit_any_shard(db, user_address, amount):
+            metrics.BALANCE_SHARD_DEBITS.inc(result="shard")
+            return True
+
+        # 分片都不够：尝试主行（尚未分配的充值在主行）
+        metrics.BALANCE_SHARD_DEBIT_ATTEMPTS.inc()
+        rowcount = db.execute(queries.DEBIT_BALANCE, {"u": user_address, "amount": amount}).rowcount
+        db.commit()
+        if rowcount == 1:
+            metrics.BALANCE_SHARD_DEBITS.inc(result="main")
+            return True
+
+        # 资金可能分散在多个分片：重新分配后再试一次
+        if not self._claim_inline_rebalance(user_address):
+            # 刚有请求就地重新分配过：交给后台任务，只再试一次分片（资金可能已经合并）
+            self._wake_background()
+            if self._debit_any_shard(db, user_address, amount):
+                metrics.BALANCE_SHARD_DEBITS.inc(result="shard")
+                return True
+            metrics.BALANCE_SHARD_DEBITS.inc(result="insufficient")
+            return False
+        try:
+            total = self.rebalance(db, user_address, reason="fragmented")
+        except Exception as e:
+            # 锁等待超时等：本次按扣费失败处理（调用方返回 402），不把数据库错误变成 500
+            logger.warning("Inline balance shard rebalance failed: %s", e, extra={"user": user_address})
+            metrics.BALANCE_SHARD_DEBITS.inc(result="rebalance_failed")
+            return False
+        if total >= amount and self._debit_any_shard(db, user_address, amount):
+            metrics.BALANCE_SHARD_DEBITS.inc(result="rebalanced")
+            return True
+        metrics.BALANCE_SHARD_DEBITS.inc(result="insufficient")
+        return False
+
+    def _claim_inline_rebalance(self, user_address: str) -> bool:
+        """同一用户每 inline_rebalance_interval 秒只允许一个请求就地重新分配"""
+        now = time.monotonic()
+        with self._inline_lock:
+            last = self._last_inline.get(user_address)
+            if last is not None and now - last < self.inline_rebalance_interval:
+                return False
+            self._last_inline[user_address] = now
+            return True
+
+    def _wake_background(self) -> None:
+        """让后台任务立即执行一轮重新分配（可在任意线程调用）"""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # ---------- 重新分配 ----------
+
+    def rebalance(self, db, user_address: str, shards: Optional[int] = None, reason: str = "periodic") -> int:
+        """
+        在一个事务内锁住主行与全部分片，把总额均分到前 shards 个分片（余数放在 0 号分片）
+
+        shards=0 表示合并回主行。
+
+        Returns:
+            总余额 wei（用户不存在时为 0）
+        """
+        shards = self.shards if shards is None else shards
+        try:
+            # 先锁主行：同一用户的重新分配在这里排队，之后补齐与锁定分片时不会与另一个重新分配交错
+            main_row = db.execute(queries.LOCK_MAIN_BALANCE, {"u": user_address}).first()
+            if main_row is None:
+                db.rollback()
+                return 0
+            if shards:
+                db.execute(queries.ENSURE_SHARD, [{"u": user_address, "s": s} for s in range(shards)])
+            current = {int(s): int(b) for s, b in db.execute(queries.LOCK_SHARDS, {"u": user_address})}
+            total = int(main_row[0]) + sum(current.values())
+
+            target = {s: 0 for s in current}
+            if shards:
+                share, remainder = divmod(total, shards)
+                target.update({s: share for s in range(shards)})
+                target[0] += remainder
+                main_balance = 0
+            else:
+                main_balance = total
+
+            if main_balance != int(main_row[0]):
+                db.execute(queries.SET_MAIN_BALANCE, {"u": user_address, "b": main_balance})
+            changed = [{"u": user_address, "s": s, "b": b} for s, b in target.items() if current.get(s) != b]
+            if changed:
+                db.execute(queries.SET_SHARD_BALANCE, changed)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        metrics.BALANCE_SHARD_REBALANCES.inc(reason=reason)
+        return total
+
+    def _rebalance_all(self) -> None:
+        db = self.session_factory()
+        try:
+            for user_address in self.users:
+                self.rebalance(db, user_address)
+        finally:
+            db.close()
+
+    def _collapse_unconfigured(self) -> int:
+        """把不再是热点用户的分片资金合并回主行"""
+        db = self.session_factory()
+        try:
+            users = [row[0] for row in db.execute(queries.SELECT_USERS_WITH_SHARD_FUNDS)]
+            db.commit()
+            collapsed = 0
+            for user_address in users:
+                if user_address not in self.users:
+                    self.rebalance(db, user_address, shards=0, reason="collapse")
+                    collapsed += 1
+            return collapsed
+        finally:
+            db.close()
+
+    # ---------- 生命周期 ----------
+
+    async def start(self) -> None:
+        try:
+            collapsed = await asyncio.to_thread(self._collapse_unconfigured)
+            if collapsed:
+                logger.info("Collapsed balance shards for %d users", collapsed)
+        except Exception as e:
+            logger.warning("Balance shard collapse skipped: %s", e)
+        if self.enabled:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._rebalance_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _rebalance_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self._rebalance_all)
+            except Exception as e:
+                logger.warning("Balance shard rebalance failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.rebalance_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
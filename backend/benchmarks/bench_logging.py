@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+日志写出开销基准：print 与队列日志在慢速 stdout 下的调用方耗时
+
+用一个每次 write 都休眠的 stdout 模拟变慢的日志管道（容器日志驱动、终端），对比：
+- print：调用方同步写 stdout，每次调用都要等管道
+- logging：logs.setup_logging 的有界队列 + 后台线程，调用方只构造记录并入队，队列满时丢弃
+
+用法：
+    python benchmarks/bench_logging.py --calls 2000 --write-delay-ms 1
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logs  # noqa: E402
+import metrics  # noqa: E402
+
+
+class SlowStream:
+    """每次 write 休眠 delay 秒的输出流"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, data: str) -> int:
+        time.sleep(self.delay)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def bench_print(calls: int, stream: SlowStream) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        print(f"📊 Usage logged for 0xabc: {i} tokens", file=stream)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def bench_logging(calls: int, stream: SlowStream, queue_size: int) -> float:
+    stdout, sys.stdout = sys.stdout, stream
+    try:
+        logs.setup_logging("INFO", queue_size=queue_size)
+    finally:
+        sys.stdout = stdout
+    logger = logging.getLogger("bench")
+    started = time.perf_counter()
+    for i in range(calls):
+        logger.info("Usage logged", extra={"event": "usage", "user": "0xabc", "total_tokens": i})
+    elapsed = (time.perf_counter() - started) / calls * 1e6
+    logs.shutdown_logging()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark caller-side logging cost with a slow stdout")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--write-delay-ms", type=float, default=1.0, help="每次写 stdout 的延迟")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    stream = SlowStream(args.write_delay_ms / 1000)
+    print(f"{'path':>10} {'us/call':>10}")
+    print(f"{'print':>10} {bench_print(args.calls, stream):10.1f}")
+    print(f"{'logging':>10} {bench_logging(args.calls, stream, args.queue_size):10.1f}")
+    print(f"dropped: {int(metrics.LOG_RECORDS_DROPPED.value())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+指标埋点开销基准（不需要 MySQL / RPC / 真实上游）
+
+1. 单次操作：Counter.inc、Histogram.observe、model 标签限制、SQL 语句计时等单个埋点的耗时
+2. 整个请求：进程内（ASGI）发送 /v1/messages 流式请求，上游用 httpx.MockTransport 返回固定的 SSE 流，
+   统计每个请求的埋点次数，按单次耗时估算埋点开销；并交替测量埋点开启与关闭
+   （把 inc / observe 替换为空函数）时每个请求的 CPU 时间作为对照（差值受噪声影响，多跑几轮取最小值）
+
+代理本身的开销是真实请求耗时的下限（真实请求还包括网络、数据库与上游推理），
+埋点开销占这个下限的比例不超过 1%，占真实请求的比例只会更低。
+
+用法：
+    python benchmarks/bench_metrics_overhead.py --requests 2000 --events 50
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 跳过余额检查，不需要数据库；上游地址只用于构造请求，实际由 MockTransport 应答
+os.environ["SKIP_BALANCE_CHECK"] = "true"
+os.environ.setdefault("CLAUDE_BACKEND_URL", "http://upstream.invalid/v1/messages")
+os.environ.setdefault("CLAUDE_API_KEY", "bench")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+import metrics  # noqa: E402
+
+BODY = b'{"model": "claude-3-5-sonnet-20241022", "max_tokens": 1024, "stream": true, "messages": [{"role": "user", "content": "hi"}]}'
+
+
+def build_sse(events: int) -> bytes:
+    parts = [
+        'event: message_start\ndata: {"type": "message_start", "message": {"usage": {"input_tokens": 12, "output_tokens": 1}}}\n\n'
+    ]
+    for i in range(events):
+        parts.append(
+            'event: content_block_delta\n'
+            f'data: {{"type": "content_block_delta", "index": 0, "delta": {{"type": "text_delta", "text": "token {i} "}}}}\n\n'
+        )
+    parts.append('event: message_delta\ndata: {"type": "message_delta", "usage": {"output_tokens": %d}}\n\n' % events)
+    parts.append('event: message_stop\ndata: {"type": "message_stop"}\n\n')
+    return "".join(parts).encode()
+
+
+def count_updates(requests: int, events: int) -> float:
+    """每个请求调用 inc / observe 的次数"""
+    calls = 0
+    inc, observe = metrics.Counter.inc, metrics.Histogram.observe
+
+    def counting_inc(self, amount=1, **labels):
+        nonlocal calls
+        calls += 1
+        inc(self, amount, **labels)
+
+    def counting_observe(self, value, **labels):
+        nonlocal calls
+        calls += 1
+        observe(self, value, **labels)
+
+    metrics.Counter.inc, metrics.Histogram.observe = counting_inc, counting_observe
+    try:
+        asyncio.run(bench_requests(requests, events, warmup=0))
+    finally:
+        metrics.Counter.inc, metrics.Histogram.observe = inc, observe
+    return calls / requests
+
+
+def per_op(fn, n: int = 200_000) -> float:
+    """返回单次调用的纳秒数"""
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e9
+
+
+def bench_ops() -> float:
+    """打印单次操作耗时，返回 inc / observe 的平均纳秒数"""
+    counter = metrics.Counter("bench_counter_total", "bench", ("model", "mode"))
+    histogram = metrics.Histogram("bench_seconds", "bench", ("model", "mode"))
+    limiter = metrics.LabelLimiter()
+    statement = "SELECT balance FROM user_balances WHERE user_address = %(u)s"
+    costs = {}
+
+    def statement_timer():
+        started = time.perf_counter()
+        words = statement.split(None, 1)
+        verb = words[0].upper() if words else "OTHER"
+        metrics.DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, verb=verb)
+
+    print(f"{'operation':>28} {'ns/op':>8}")
+    for name, fn in (
+        ("Counter.inc", lambda: counter.inc(model="m", mode="stream")),
+        ("Histogram.observe", lambda: histogram.observe(0.123, model="m", mode="stream")),
+        ("model label limiter", lambda: limiter("claude-3-5-sonnet-20241022")),
+        ("perf_counter", time.perf_counter),
+        ("SQL statement timer", statement_timer),
+    ):
+        cost = per_op(fn)
+        costs[name] = cost
+        print(f"{name:>28} {cost:8.0f}")
+    return (costs["Counter.inc"] + costs["Histogram.observe"]) / 2
+
+
+def _disable_metrics() -> dict:
+    saved = {
+        (metrics.Counter, "inc"): metrics.Counter.inc,
+        (metrics.Histogram, "observe"): metrics.Histogram.observe,
+    }
+    metrics.Counter.inc = lambda self, amount=1, **labels: None
+    metrics.Histogram.observe = lambda self, value, **labels: None
+    return saved
+
+
+def _restore_metrics(saved: dict) -> None:
+    for (cls, attr), fn in saved.items():
+        setattr(cls, attr, fn)
+
+
+async def bench_requests(requests: int, events: int, warmup: int = 50) -> float:
+    """返回每个请求的 CPU 微秒数"""
+    sse = build_sse(events)
+    main.claude_upstream._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, content=sse, headers={"content-type": "text/event-stream"})
+        )
+    )
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench")
+    headers = {"content-type": "application/json"}
+    try:
+        for _ in range(warmup):
+            await client.post("/v1/messages", content=BODY, headers=headers)
+        started = time.process_time()
+        for _ in range(requests):
+            response = await client.post("/v1/messages", content=BODY, headers=headers)
+            assert response.status_code == 200, response.text
+        return (time.process_time() - started) / requests * 1e6
+    finally:
+        await client.aclose()
+        await main.claude_upstream.aclose()
+
+
+def main_entry():
+    parser = argparse.ArgumentParser(description="Benchmark metrics instrumentation overhead")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=50, help="每个流式响应的 SSE 事件数")
+    parser.add_argument("--rounds", type=int, default=3, help="交替测量的轮数，取最小值")
+    args = parser.parse_args()
+
+    update_ns = bench_ops()
+
+    # 代理路径会打印 usage 日志，测量期间丢弃标准输出
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    on, off = [], []
+    try:
+        updates = count_updates(200, args.events)
+        for i in range(args.rounds):
+            # 交替先后顺序，抵消预热与频率调节的影响
+            for enabled in ((True, False) if i % 2 == 0 else (False, True)):
+                gc.collect()
+                saved = None if enabled else _disable_metrics()
+                try:
+                    (on if enabled else off).append(asyncio.run(bench_requests(args.requests, args.events)))
+                finally:
+                    if saved is not None:
+                        _restore_metrics(saved)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    with_metrics, without_metrics = min(on), min(off)
+    estimated = updates * update_ns / 1000
+    print()
+    print(f"{'metrics':>10} {'cpu_us/request':>15}")
+    print(f"{'off':>10} {without_metrics:15.1f}")
+    print(f"{'on':>10} {with_metrics:15.1f}")
+    print(f"measured difference: {(with_metrics - without_metrics) / without_metrics * 100:+.2f}%")
+    print(
+        f"estimated overhead: {updates:.0f} updates/request x {update_ns:.0f} ns = {estimated:.1f} us "
+        f"({estimated / without_metrics * 100:.2f}% of in-process proxy cost, {args.events} SSE events per request)"
+    )
+
+
+if __name__ == "__main__":
+    main_entry()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+/v1/messages 请求体处理开销基准
+
+对比两种路径处理单个大 prompt 的 CPU 时间与峰值内存（按每 MB 请求体折算）：
+- legacy：json.loads → ClaudeMessageRequest 校验 → model_dump → json.dumps（改造前）
+- fast：parse_message_head 只解析 model / max_tokens / stream，原始字节直接转发
+
+用法：
+    python benchmarks/bench_request_body.py --sizes 1 4 16 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ClaudeMessageRequest  # noqa: E402
+from request_body import parse_message_head, PARSER  # noqa: E402
+
+
+def build_body(size_mb: float) -> bytes:
+    """构造约 size_mb 大小的多轮对话请求体"""
+    chunk = "The quick brown fox jumps over the lazy dog. " * 20
+    messages = []
+    total = 0
+    target = int(size_mb * 1024 * 1024)
+    i = 0
+    while total < target:
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": [{"type": "text", "text": chunk}]})
+        total += len(chunk) + 60
+        i += 1
+    body = {
+        "model": "claude-3-5-sonnet-20241022",
+        "max_tokens": 4096,
+        "stream": True,
+        "system": "You are a helpful assistant",
+        "messages": messages,
+    }
+    return json.dumps(body).encode("utf-8")
+
+
+def legacy_path(body: bytes) -> bytes:
+    request = ClaudeMessageRequest(**json.loads(body))
+    return json.dumps(request.model_dump(exclude_none=True)).encode("utf-8")
+
+
+def fast_path(body: bytes) -> bytes:
+    parse_message_head(body)
+    return body
+
+
+def measure(fn, body: bytes, repeat: int) -> tuple[float, float]:
+    """返回 (平均 CPU 秒, 峰值新增内存 MB)"""
+    fn(body)  # 预热
+    started = time.process_time()
+    for _ in range(repeat):
+        fn(body)
+    cpu = (time.process_time() - started) / repeat
+
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /v1/messages body handling")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="请求体大小（MB）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"fast path parser: {PARSER}")
+    print(f"{'size_MB':>8} {'path':>7} {'cpu_ms/MB':>10} {'peak_MB/MB':>11}")
+    for size in args.sizes:
+        body = build_body(size)
+        actual_mb = len(body) / 1024 / 1024
+        for name, fn in (("legacy", legacy_path), ("fast", fast_path)):
+            cpu, peak = measure(fn, body, args.repeat)
+            print(f"{actual_mb:8.1f} {name:>7} {cpu * 1000 / actual_mb:10.2f} {peak / actual_mb:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+扣费路径 SQL 语句开销基准
+
+扣费（check_and_deduct_balance）每次执行 SELECT 余额 + 条件 UPDATE + 提交。
+用内存 SQLite 作为"零延迟"数据库，只测量 Python / SQLAlchemy 侧的开销：
+- raw：直接用 DBAPI 游标（下限）
+- inline：每次调用都 text("...") 构造语句（改造前）
+- module：queries.py 中导入时构造好的语句（改造后）
+
+用法：
+    python benchmarks/bench_sql_statements.py --ops 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+import queries  # noqa: E402
+
+USER = "0x97EC65A46a33a11727e430393B57010909f4bb4D"
+
+
+def setup_engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE user_balances (user_address VARCHAR(42) PRIMARY KEY, balance INTEGER)"))
+        conn.execute(text("INSERT INTO user_balances VALUES (:u, :b)"), {"u": USER, "b": 10 ** 15})
+    return engine
+
+
+def debit_inline(db):
+    row = db.execute(
+        text("SELECT balance FROM user_balances WHERE user_address = :addr"),
+        {"addr": USER},
+    ).fetchone()
+    db.execute(
+        text(
+            "UPDATE user_balances "
+            "SET balance = balance - :amount "
+            "WHERE user_address = :addr AND balance >= :amount"
+        ),
+        {"addr": USER, "amount": 1},
+    )
+    db.commit()
+    return row
+
+
+def debit_module(db):
+    row = db.execute(queries.SELECT_BALANCE, {"u": USER}).fetchone()
+    db.execute(queries.DEBIT_BALANCE, {"u": USER, "amount": 1})
+    db.commit()
+    return row
+
+
+def debit_raw(dbapi_conn):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("SELECT balance FROM user_balances WHERE user_address = ?", (USER,))
+    row = cursor.fetchone()
+    cursor.execute(
+        "UPDATE user_balances SET balance = balance - ? WHERE user_address = ? AND balance >= ?",
+        (1, USER, 1),
+    )
+    dbapi_conn.commit()
+    cursor.close()
+    return row
+
+
+def bench(fn, arg, ops: int) -> float:
+    """返回每次扣费的平均微秒数"""
+    for _ in range(min(ops // 10, 1000)):
+        fn(arg)  # 预热（填充编译缓存）
+    started = time.perf_counter()
+    for _ in range(ops):
+        fn(arg)
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark debit-path statement overhead")
+    parser.add_argument("--ops", type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = setup_engine()
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    inline_us = bench(debit_inline, db, args.ops)
+    module_us = bench(debit_module, db, args.ops)
+    db.close()
+
+    raw_conn = engine.raw_connection()
+    raw_us = bench(debit_raw, raw_conn.dbapi_connection, args.ops)
+    raw_conn.close()
+
+    construct_started = time.perf_counter()
+    for _ in range(args.ops):
+        text("UPDATE user_balances SET balance = balance - :amount WHERE user_address = :addr AND balance >= :amount")
+    construct_us = (time.perf_counter() - construct_started) / args.ops * 1e6
+
+    print(f"{'path':>7} {'us/debit':>9} {'us/stmt over raw':>17} {'max debits/s/core':>18}")
+    for name, value in (("raw", raw_us), ("inline", inline_us), ("module", module_us)):
+        print(f"{name:>7} {value:9.1f} {(value - raw_us) / 2:17.1f} {1e6 / value:18.0f}")
+    print(f"text() construction alone: {construct_us:.1f} us/statement")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
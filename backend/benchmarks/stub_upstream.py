@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+本地 Claude 上游桩服务（供 bench_proxy.py 使用，也可以单独启动）
+
+POST /v1/messages 按 Claude Messages API 的格式应答：
+- 流式：message_start → content_block_start → ping → 多个 content_block_delta → content_block_stop
+  → message_delta（含 output_tokens）→ message_stop
+- 非流式：等待完整生成时间后返回一个 message JSON
+
+输出 token 数取 min(请求 max_tokens, --output-tokens)，生成速度由 --tokens-per-second 控制（0 表示不等待），
+首个 delta 之前等待 --ttft-ms。每个 delta 含 --tokens-per-delta 个 token，每个 token --chars-per-token 个字符。
+
+用法：
+    python benchmarks/stub_upstream.py --port 18080 --output-tokens 300 --tokens-per-second 100 --ttft-ms 300
+"""
+import argparse
+import asyncio
+import json
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")
+
+
+def _event(name: str, payload: dict) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n".encode()
+
+
+def _text(tokens: int, chars_per_token: int, offset: int) -> str:
+    parts = []
+    for i in range(tokens):
+        word = WORDS[(offset + i) % len(WORDS)]
+        parts.append((" " + word)[:chars_per_token].ljust(chars_per_token, "x"))
+    return "".join(parts)
+
+
+def create_app(
+    output_tokens: int = 300,
+    input_tokens: int = 1000,
+    tokens_per_second: float = 100.0,
+    tokens_per_delta: int = 1,
+    chars_per_token: int = 4,
+    ttft: float = 0.3,
+) -> Starlette:
+    """
+    Args:
+        output_tokens: 每个响应最多输出的 token 数
+        input_tokens: usage 中报告的输入 token 数
+        tokens_per_second: 单个响应的生成速度，0 表示不等待
+        tokens_per_delta: 每个 content_block_delta 的 token 数
+        chars_per_token: 每个 token 的字符数
+        ttft: 首个 token 之前的等待（秒）
+    """
+    delta_interval = tokens_per_delta / tokens_per_second if tokens_per_second > 0 else 0
+
+    async def stream_events(model: str, total: int):
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        yield _event("message_start", {
+            "type": "message_start",
+            "message": {
+                "id": message_id,
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [],
+                "stop_reason": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+            },
+        })
+        yield _event("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}
+        })
+        yield _event("ping", {"type": "ping"})
+        if ttft > 0:
+            await asyncio.sleep(ttft)
+        sent = 0
+        while sent < total:
+            count = min(tokens_per_delta, total - sent)
+            yield _event("content_block_delta", {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": _text(count, chars_per_token, sent)},
+            })
+            sent += count
+            if delta_interval > 0 and sent < total:
+                await asyncio.sleep(delta_interval)
+        yield _event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield _event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": total},
+        })
+        yield _event("message_stop", {"type": "message_stop"})
+
+    async def messages(request: Request):
+        body = json.loads(await request.body())
+        model = body.get("model", "claude-stub")
+        total = max(1, min(int(body.get("max_tokens", output_tokens)), output_tokens))
+        if body.get("stream"):
+            return StreamingResponse(stream_events(model, total), media_type="text/event-stream")
+
+        generation = ttft + (total / tokens_per_second if tokens_per_second > 0 else 0)
+        if generation > 0:
+            await asyncio.sleep(generation)
+        return JSONResponse({
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": _text(total, chars_per_token, 0)}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": total},
+        })
+
+    return Starlette(routes=[Route("/v1/messages", messages, methods=["POST"])])
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """桩服务的参数（bench_proxy.py 复用并原样传给子进程）"""
+    parser.add_argument("--output-tokens", type=int, default=300, help="每个响应最多输出的 token 数")
+    parser.add_argument("--input-tokens", type=int, default=1000, help="usage 中报告的输入 token 数")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="单个响应的生成速度，0 表示不等待")
+    parser.add_argument("--tokens-per-delta", type=int, default=1, help="每个 content_block_delta 的 token 数")
+    parser.add_argument("--chars-per-token", type=int, default=4, help="每个 token 的字符数")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="首个 token 之前的等待（毫秒）")
+
+
+def stub_argv(args: argparse.Namespace) -> list:
+    """把解析后的参数还原为命令行"""
+    return [
+        "--output-tokens", str(args.output_tokens),
+        "--input-tokens", str(args.input_tokens),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--tokens-per-delta", str(args.tokens_per_delta),
+        "--chars-per-token", str(args.chars_per_token),
+        "--ttft-ms", str(args.ttft_ms),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Claude Messages API upstream emitting realistic SSE")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_app(
+        output_tokens=args.output_tokens,
+        input_tokens=args.input_tokens,
+        tokens_per_second=args.tokens_per_second,
+        tokens_per_delta=args.tokens_per_delta,
+        chars_per_token=args.chars_per_token,
+        ttft=args.ttft_ms / 1000,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
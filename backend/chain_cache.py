@@ -0,0 +1,273 @@
+"""
+链上状态微缓存
+
+每次支付都要查 gas_price、发送方余额与 nonce，/health 每次探活都要查 block_number。
+这些是链级别（或少数服务账户）的值，每个区块才变化一次，没有必要每个请求都打到 RPC 节点：
+
+1. 后台任务每 poll_interval 秒查一次 block_number，出块后（或值快要过期时）刷新 gas_price 与关注地址的余额
+2. 读取时值在 ttl 内直接返回；过期时同一个 key 只有一个线程去刷新（single-flight），其他线程等待结果
+3. 刷新失败时在 max_stale 内返回旧值，超过则抛出原异常
+4. 发送交易后从缓存余额中扣掉金额与 gas，不用等下一个区块刷新
+
+nonce 默认每次查询节点的 pending 计数。开启 local_nonce（CHAIN_NONCE_LOCAL）时服务账户的 nonce
+在进程内分配：同一地址在整个进程只有一个序列（main 的 PRIVATE_KEY 与 Facilitator 是同一个账户，
+两边共用 nonce_allocator），第一次从节点取 pending nonce，之后每笔交易加一；发送失败时丢弃本地值，
+nonce 类错误立即重新同步并重发一次。本地分配只在单进程发送时正确，多 worker（WEB_CONCURRENCY > 1）
+时自动退回查询节点。用户自己的钱包可能在别处发交易，它们的 nonce 始终查询节点。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from web3 import Web3
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """一个缓存值及其刷新锁"""
+
+    __slots__ = ("value", "fetched_at", "lock")
+
+    def __init__(self):
+        self.value = None
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def age(self, now: float) -> float:
+        return now - self.fetched_at if self.value is not None else float("inf")
+
+
+# 节点返回的 nonce 冲突类错误（不同客户端措辞不同）
+_NONCE_ERRORS = (
+    "nonce too low",
+    "nonce too high",
+    "invalid nonce",
+    "already known",
+    "replacement transaction underpriced",
+)
+
+
+def is_nonce_error(exc: BaseException) -> bool:
+    message = str(exc).lower()
+    return any(s in message for s in _NONCE_ERRORS)
+
+
+class NonceAllocator:
+    """按地址在进程内递增分配 nonce"""
+
+    def __init__(self):
+        self._nonces: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def next(self, w3, address: str) -> tuple[int, bool]:
+        """
+        Returns:
+            (nonce, 是否本地命中)；没有本地值时从节点取 pending nonce
+        """
+        with self._lock:
+            nonce = self._nonces.get(address)
+            hit = nonce is not None
+            if not hit:
+                nonce = w3.eth.get_transaction_count(address, "pending")
+            self._nonces[address] = nonce + 1
+            return nonce, hit
+
+    def reset(self, address: str) -> None:
+        with self._lock:
+            self._nonces.pop(address, None)
+
+
+# 进程内唯一的分配器：同一地址的所有 ChainStateCache 共用一个序列
+nonce_allocator = NonceAllocator()
+
+
+def _worker_count() -> int:
+    try:
+        return int(os.getenv("WEB_CONCURRENCY", "1"))
+    except ValueError:
+        return 1
+
+
+class ChainStateCache:
+    """block_number / gas_price / 余额的短 TTL 缓存与服务账户 nonce 分配"""
+
+    def __init__(
+        self,
+        w3,
+        name: str = "main",
+        ttl: float = 2.0,
+        max_stale: float = 30.0,
+        poll_interval: float = 1.0,
+        watch: Iterable[str] = (),
+        local_nonce: bool = False,
+    ):
+        """
+        Args:
+            w3: Web3 实例（同步调用，后台刷新在线程中执行）
+            name: 指标标签，区分同一进程内的多个缓存（main / facilitator）
+            ttl: 值的有效期（秒），0 表示关闭缓存（每次都查节点）
+            max_stale: 刷新失败时最多返回多旧的值（秒）
+            poll_interval: 后台查询 block_number 的间隔（秒）
+            watch: 由本进程签名发送交易的地址：后台刷新余额
+            local_nonce: 关注地址的 nonce 在进程内分配（仅单进程发送时开启）
+        """
+        self.w3 = w3
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.poll_interval = poll_interval
+        self.watch = {Web3.to_checksum_address(a) for a in watch if a}
+        self._entries: dict[tuple, _Entry] = {}
+        self._entries_lock = threading.Lock()
+        if local_nonce and _worker_count() > 1:
+            logger.warning("CHAIN_NONCE_LOCAL ignored with multiple workers, nonces are read from the node")
+            local_nonce = False
+        self.local_nonce = local_nonce
+        self._task: Optional[asyncio.Task] = None
+        for key in ("block_number", "gas_price"):
+            metrics.CHAIN_CACHE_AGE.set_function(
+                lambda k=key: min(self._entry((k,)).age(time.monotonic()), 1e9), cache=name, key=key
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _entry(self, key: tuple) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is None:
+            with self._entries_lock:
+                entry = self._entries.setdefault(key, _Entry())
+        return entry
+
+    def _get(self, key: tuple, fetch: Callable, force: bool = False):
+        kind = key[0]
+        if not self.enabled:
+            return fetch()
+        entry = self._entry(key)
+        if not force and entry.age(time.monotonic()) <= self.ttl:
+            metrics.CHAIN_CACHE_REQUESTS.inc(cache=self.name, key=kind, result="hit")
+            return entry.value
+        requested_at = time.monotonic()
+        with entry.lock:
+            # 等锁期间别的线程已经刷新过：直接用它的结果
+            if entry.fetched_at >= requested_at or (not force and entry.age(time.monotonic()) <= self.ttl):
+                metrics.CHAIN_CACHE_REQUESTS.inc(cache=self.name, key=kind, result="coalesced")
+                return entry.value
+            try:
+                value = fetch()
+            except Exception:
+                metrics.CHAIN_CACHE_REFRESH_ERRORS.inc(cache=self.name, key=kind)
+                if entry.age(time.monotonic()) <= self.max_stale:
+                    metrics.CHAIN_CACHE_REQUESTS.inc(cache=self.name, key=kind, result="stale")
+                    return entry.value
+                raise
+            entry.value = value
+            entry.fetched_at = time.monotonic()
+            metrics.CHAIN_CACHE_REQUESTS.inc(cache=self.name, key=kind, result="miss")
+            return value
+
+    # ---------- 读取 ----------
+
+    def block_number(self, force: bool = False) -> int:
+        return self._get(("block_number",), lambda: self.w3.eth.block_number, force)
+
+    def gas_price(self, force: bool = False) -> int:
+        return self._get(("gas_price",), lambda: self.w3.eth.gas_price, force)
+
+    def balance(self, address: str, force: bool = False) -> int:
+        address = Web3.to_checksum_address(address)
+        return self._get(("balance", address), lambda: self.w3.eth.get_balance(address), force)
+
+    def block_age(self) -> float:
+        """缓存的 block_number 距上次刷新的秒数（从未刷新为 inf）"""
+        return self._entry(("block_number",)).age(time.monotonic())
+
+    # ---------- 服务账户 nonce ----------
+
+    def next_nonce(self, address: str) -> int:
+        """分配下一个 nonce：开启 local_nonce 时关注地址本地递增，其他情况每次查询节点"""
+        address = Web3.to_checksum_address(address)
+        if not self.local_nonce or address not in self.watch:
+            return self.w3.eth.get_transaction_count(address, "pending")
+        nonce, hit = nonce_allocator.next(self.w3, address)
+        metrics.CHAIN_CACHE_REQUESTS.inc(cache=self.name, key="nonce", result="hit" if hit else "miss")
+        return nonce
+
+    def reset_nonce(self, address: str) -> None:
+        """发送失败后调用：丢弃本地 nonce，下一次从节点重新同步"""
+        nonce_allocator.reset(Web3.to_checksum_address(address))
+
+    def send_transaction(self, address: str, sign: Callable[[int], bytes]):
+        """
+        分配 nonce、签名并发送；nonce 冲突时重新从节点同步并重发一次
+
+        Args:
+            address: 发送方地址
+            sign: 按给定 nonce 构建并签名交易，返回 raw transaction
+
+        Returns:
+            (tx_hash, nonce)
+        """
+        for attempt in range(2):
+            nonce = self.next_nonce(address)
+            try:
+                return self.w3.eth.send_raw_transaction(sign(nonce)), nonce
+            except Exception as e:
+                self.reset_nonce(address)
+                if attempt or not is_nonce_error(e):
+                    raise
+                metrics.CHAIN_CACHE_REQUESTS.inc(cache=self.name, key="nonce", result="resync")
+                logger.warning("Nonce conflict for %s (%s), resyncing from node", address, e)
+
+    def note_spent(self, address: str, amount_wei: int) -> None:
+        """交易已发出：从缓存余额中扣掉（值与 gas），下一个区块刷新时以节点为准"""
+        entry = self._entries.get(("balance", Web3.to_checksum_address(address)))
+        if entry is not None:
+            with entry.lock:
+                if entry.value is not None:
+                    entry.value = max(entry.value - amount_wei, 0)
+
+    # ---------- 后台刷新 ----------
+
+    def refresh(self) -> bool:
+        """
+        查询一次 block_number；出块时（或值快要过期时）刷新 gas_price 与关注地址的余额
+
+        Returns:
+            是否出了新块
+        """
+        previous = self._entry(("block_number",)).value
+        current = self.block_number(force=True)
+        new_block = current != previous
+        now = time.monotonic()
+        if new_block or self._entry(("gas_price",)).age(now) > self.ttl / 2:
+            self.gas_price(force=True)
+        for address in self.watch:
+            if new_block or self._entry(("balance", address)).age(now) > self.ttl / 2:
+                self.balance(address, force=True)
+        return new_block
+
+    async def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.warning("Chain state refresh failed (%s): %s", self.name, e)
+            await asyncio.sleep(self.poll_interval)
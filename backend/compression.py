@@ -0,0 +1,316 @@
+"""
+代理路径上的压缩支持
+
+1. 请求：按 Content-Encoding（gzip / deflate / zstd）边接收边解压，带解压后大小上限
+2. 响应：按 Accept-Encoding 协商压缩非流式 JSON，可选压缩 SSE（按事件边界 flush）
+3. 上游：可选压缩转发给上游的请求体
+
+zstd 依赖可选的 zstandard 包，未安装时只支持 gzip / deflate。
+所有编解码都以流式 compressobj / decompressobj 进行，内存占用与块大小相关而非整体大小。
+"""
+import zlib
+from typing import AsyncIterator, NamedTuple, Optional
+
+from fastapi import Request
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+
+class UnsupportedEncoding(ValueError):
+    """不支持的 Content-Encoding"""
+
+
+class BodyTooLarge(ValueError):
+    """解压后的请求体超过上限"""
+
+
+class DecodedBody(NamedTuple):
+    """解压后的请求体"""
+    content: bytes  # 解压后的内容
+    encoding: str  # 客户端使用的编码（identity 为空串）
+    # 客户端发来的原始（压缩）字节：identity 时与 content 相同；
+    # 压缩时只在编码等于 keep_raw_encoding（会原样转发上游）时保留，否则为 None
+    raw: Optional[bytes]
+
+
+# ---------- 编码器 ----------
+
+class _Encoder:
+    """统一 gzip / zstd 的流式压缩接口"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            # wbits=31 输出 gzip 格式
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush_block(self) -> bytes:
+        """刷出已缓冲的数据，使客户端能立即解出当前内容（不结束流）"""
+        if self.encoding == "zstd":
+            return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class _BoundedSink:
+    """zstd stream_writer 的输出端：累计超过上限时抛出 BodyTooLarge，中止本次解压"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.total += len(data)
+        if self.total > self.max_bytes:
+            raise BodyTooLarge(f"Decompressed body exceeds {self.max_bytes} bytes")
+        self.chunks.append(data)
+        return len(data)
+
+
+# zstd 每次向输出端写出的最大字节数：超限时最多多解压这么多
+ZSTD_WRITE_SIZE = 64 * 1024
+
+_ZSTD_MAGIC = 0xFD2FB528
+
+
+class _ZstdFrames:
+    """
+    只解析帧头与块头，跟踪输入是否停在完整的 zstd 帧末尾
+
+    stream_writer 不报告帧是否结束，截断的压缩体会被当作较短的合法内容接受。
+    """
+
+    def __init__(self):
+        self._buf = b""
+        self._skip = 0
+        self._in_frame = False
+        self._checksum = False
+        self._frames = 0
+
+    @property
+    def complete(self) -> bool:
+        return self._frames > 0 and not self._in_frame and not self._skip and not self._buf
+
+    def feed(self, data: bytes) -> None:
+        data = self._buf + data if self._buf else data
+        pos, end = 0, len(data)
+        while True:
+            if self._skip:
+                step = min(self._skip, end - pos)
+                pos += step
+                self._skip -= step
+                if self._skip:
+                    break
+            if not self._in_frame:
+                if end - pos < 8:
+                    break
+                magic = int.from_bytes(data[pos:pos + 4], "little")
+                if magic & 0xFFFFFFF0 == 0x184D2A50:
+                    # skippable frame：魔数 + 4 字节长度 + 内容
+                    self._skip = 8 + int.from_bytes(data[pos + 4:pos + 8], "little")
+                    continue
+                if magic != _ZSTD_MAGIC:
+                    raise ValueError("Invalid zstd body: unknown frame magic")
+                descriptor = data[pos + 4]
+                single_segment = descriptor >> 5 & 1
+                size_flag = descriptor >> 6
+                header = (
+                    5
+                    + (0 if single_segment else 1)
+                    + (0, 1, 2, 4)[descriptor & 3]
+                    + ((1 if single_segment else 0), 2, 4, 8)[size_flag]
+                )
+                if end - pos < header:
+                    break
+                pos += header
+                self._in_frame = True
+                self._checksum = bool(descriptor >> 2 & 1)
+                self._frames += 1
+                continue
+            if end - pos < 3:
+                break
+            block = int.from_bytes(data[pos:pos + 3], "little")
+            pos += 3
+            block_type = block >> 1 & 3
+            if block_type == 3:
+                raise ValueError("Invalid zstd body: reserved block type")
+            # RLE 块只有一个字节的内容
+            self._skip = 1 if block_type == 1 else block >> 3
+            if block & 1:
+                self._skip += 4 if self._checksum else 0
+                self._in_frame = False
+        self._buf = data[pos:]
+
+
+def _decompressor(encoding: str):
+    if encoding == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise UnsupportedEncoding("zstd is not supported (zstandard not installed)")
+        # 返回解压上下文，由 read_request_body 创建 stream_writer
+        return zstandard.ZstdDecompressor()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(31)
+    if encoding == "deflate":
+        return zlib.decompressobj(15)
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+
+
+# ---------- 请求 ----------
+
+async def read_request_body(
+    request: Request, max_bytes: int, keep_raw_encoding: Optional[str] = None
+) -> DecodedBody:
+    """
+    读取并（按需）解压请求体
+
+    Args:
+        request: 客户端请求
+        max_bytes: 解压后请求体的最大字节数（防止压缩炸弹）
+        keep_raw_encoding: 客户端使用该编码时保留原始压缩字节（用于原样转发上游），其他编码不保留
+
+    Raises:
+        UnsupportedEncoding: Content-Encoding 不支持
+        BodyTooLarge: 解压后超过 max_bytes
+        ValueError: 压缩数据损坏或被截断
+    """
+    encoding = request.headers.get("content-encoding", "").strip().lower()
+    if encoding in ("", "identity"):
+        # 边接收边计数，超过上限立即中止，不先把整个请求体读进内存
+        chunks = []
+        total = 0
+        async for chunk in request.stream():
+            total += len(chunk)
+            if total > max_bytes:
+                raise BodyTooLarge(f"Request body exceeds {max_bytes} bytes")
+            chunks.append(chunk)
+        body = b"".join(chunks)
+        return DecodedBody(content=body, encoding="", raw=body)
+
+    decoder = _decompressor(encoding)
+    keep_raw = encoding == keep_raw_encoding
+    raw_chunks = []
+    out_chunks = []
+    total = 0
+    frames = _ZstdFrames() if encoding == "zstd" else None
+    if encoding == "zstd":
+        # decompressobj().decompress() 一次返回全部输出、没有上限，一个小块就可能展开成 GB 级内存；
+        # stream_writer 按 ZSTD_WRITE_SIZE 分片写入 sink，超过上限立即中止，内存不超过 max_bytes + 一个分片
+        sink = _BoundedSink(max_bytes)
+        writer = decoder.stream_writer(
+            sink, write_size=ZSTD_WRITE_SIZE, write_return_read=True
+        )
+        out_chunks = sink.chunks
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if keep_raw:
+                raw_chunks.append(chunk)
+            if encoding == "zstd":
+                frames.feed(chunk)
+                writer.write(chunk)
+                continue
+            # zlib：用 max_length 限制单次输出，避免一个小块膨胀成巨大的内存分配
+            data = chunk
+            while data:
+                out = decoder.decompress(data, max_bytes - total + 1)
+                total += len(out)
+                if total > max_bytes:
+                    raise BodyTooLarge(f"Decompressed body exceeds {max_bytes} bytes")
+                out_chunks.append(out)
+                data = decoder.unconsumed_tail
+        if encoding != "zstd":
+            out = decoder.flush()
+            total += len(out)
+            if total > max_bytes:
+                raise BodyTooLarge(f"Decompressed body exceeds {max_bytes} bytes")
+            out_chunks.append(out)
+            if not decoder.eof:
+                raise ValueError(f"Invalid {encoding} body: truncated stream")
+        elif not frames.complete:
+            raise ValueError(f"Invalid {encoding} body: truncated stream")
+    except zlib.error as e:
+        raise ValueError(f"Invalid {encoding} body: {e}")
+    except Exception as e:
+        if ZSTD_AVAILABLE and isinstance(e, zstandard.ZstdError):
+            raise ValueError(f"Invalid {encoding} body: {e}")
+        raise
+
+    return DecodedBody(
+        content=b"".join(out_chunks), encoding=encoding, raw=b"".join(raw_chunks) if keep_raw else None
+    )
+
+
+def compress_body(body: bytes, encoding: str, level: int) -> bytes:
+    """一次性压缩请求体（用于转发上游）"""
+    encoder = _Encoder(encoding, level)
+    return encoder.compress(body) + encoder.finish()
+
+
+# ---------- 响应 ----------
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择响应编码，优先 zstd（需已安装），其次 gzip
+
+    Returns:
+        "zstd" / "gzip"，都不接受时返回 None
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        parts = [p.strip() for p in item.split(";")]
+        name = parts[0]
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name] = q
+
+    def accepted(name: str) -> bool:
+        # 显式列出的编码以自身 q 值为准（gzip;q=0 表示拒绝），未列出时才看 *
+        return weights.get(name, weights.get("*", 0.0)) > 0
+
+    if ZSTD_AVAILABLE and "zstd" in weights and accepted("zstd"):
+        return "zstd"
+    if accepted("gzip"):
+        return "gzip"
+    return None
+
+
+def make_encoder(encoding: str, gzip_level: int, zstd_level: int) -> _Encoder:
+    return _Encoder(encoding, zstd_level if encoding == "zstd" else gzip_level)
+
+
+async def compress_sse(chunks: AsyncIterator[str], encoder: _Encoder) -> AsyncIterator[bytes]:
+    """
+    流式压缩 SSE：在每个事件结束（空行）时 flush，保证客户端逐事件收到数据
+    """
+    try:
+        async for chunk in chunks:
+            data = encoder.compress(chunk.encode("utf-8"))
+            if chunk == "\n" or chunk.endswith("\n\n"):
+                data += encoder.flush_block()
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        # 关闭内层生成器，确保其 finally（关闭上游、结算 usage）被执行
+        await chunks.aclose()
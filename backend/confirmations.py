@@ -0,0 +1,153 @@
+"""
+充值确认深度与 reorg 处理
+
+开启 CONFIRMATION_DEPTH 后，校验通过的充值立即以 pending 状态入账（用户马上可以使用临时余额），
+记录交易所在的区块号与区块哈希；后台任务定期复查：
+
+- 收据仍在原区块且确认数达到深度：标记为 success
+- 收据出现在另一个区块（reorg 后被重新打包）：更新区块信息，重新计算确认数
+- 收据消失或交易执行失败：连续 max_misses 次后撤销入账（status = reversed，扣回余额）
+
+节点返回的收据只来自当前规范链，因此"收据的区块哈希与记录一致"即说明原区块仍在链上。
+"""
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from web3.exceptions import TransactionNotFound
+
+import metrics
+import queries
+
+logger = logging.getLogger(__name__)
+
+
+class ConfirmationTracker:
+    """复查 pending 充值，达到确认深度后确认，发生 reorg 时撤销"""
+
+    def __init__(
+        self,
+        session_factory,
+        w3,
+        depth: int,
+        reverse: Callable,
+        interval: float = 5.0,
+        max_misses: int = 12,
+        batch_size: int = 200,
+    ):
+        """
+        Args:
+            session_factory: 数据库 Session 工厂
+            w3: Web3 实例（同步调用在线程中执行）
+            depth: 确认深度，0 表示关闭（立即以 success 入账）
+            reverse: reverse(db, user_address, amount_wei, tx_hash)，在撤销事务中扣回余额并提交
+            interval: 复查间隔（秒）
+            max_misses: 收据连续缺失多少次后撤销
+            batch_size: 每轮最多复查的记录数
+        """
+        self.session_factory = session_factory
+        self.w3 = w3
+        self.depth = depth
+        self.reverse = reverse
+        self.interval = interval
+        self.max_misses = max_misses
+        self.batch_size = batch_size
+        self._misses: dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.depth > 0
+
+    def _receipt(self, tx_hash: str):
+        # 只有"交易不存在"算缺失；节点错误直接抛出，结束本轮复查，避免节点故障时误撤销
+        try:
+            return self.w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
+
+    def _reverse(self, db, record_id: int, tx_hash: str, user_address: str, amount: int) -> bool:
+        try:
+            if db.execute(queries.REVERSE_RECHARGE, {"id": record_id}).rowcount != 1:
+                db.rollback()
+                return False
+            # 扣回余额与状态变更在同一事务中，由 reverse 提交
+            self.reverse(db, user_address, amount, tx_hash)
+        except Exception:
+            db.rollback()
+            raise
+        return True
+
+    def check_pending(self) -> dict:
+        """复查一轮 pending 充值，返回各结果的数量"""
+        counts = {"pending": 0, "confirmed": 0, "reorged": 0, "reversed": 0}
+        db = self.session_factory()
+        try:
+            rows = db.execute(queries.SELECT_PENDING_RECHARGES, {"limit": self.batch_size}).all()
+            db.commit()
+            if not rows:
+                metrics.RECHARGE_PENDING.set(0)
+                return counts
+            latest = self.w3.eth.block_number
+
+            for record_id, tx_hash, user_address, amount, block_number, block_hash in rows:
+                receipt = self._receipt(tx_hash)
+                if receipt is None or receipt.status != 1:
+                    misses = self._misses.get(record_id, 0) + 1
+                    self._misses[record_id] = misses
+                    if misses >= self.max_misses:
+                        self._misses.pop(record_id, None)
+                        if self._reverse(db, record_id, tx_hash, user_address, int(amount)):
+                            counts["reversed"] += 1
+                            metrics.RECHARGE_CONFIRMATIONS.inc(result="reversed")
+                            logger.warning(
+                                "Recharge reversed after reorg",
+                                extra={"tx_hash": tx_hash, "user": user_address, "amount_wei": int(amount)},
+                            )
+                        continue
+                    counts["pending"] += 1
+                    continue
+
+                self._misses.pop(record_id, None)
+                receipt_hash = receipt.blockHash.hex()
+                confirmations = max(latest - receipt.blockNumber + 1, 0)
+                if receipt_hash != block_hash:
+                    counts["reorged"] += 1
+                    metrics.RECHARGE_CONFIRMATIONS.inc(result="reorged")
+                    logger.info(
+                        "Recharge tx re-included: block %s -> %s", block_number, receipt.blockNumber, extra={"tx_hash": tx_hash}
+                    )
+                params = {"id": record_id, "bn": receipt.blockNumber, "bh": receipt_hash, "n": confirmations}
+                if confirmations >= self.depth:
+                    db.execute(queries.CONFIRM_RECHARGE, params)
+                    counts["confirmed"] += 1
+                    metrics.RECHARGE_CONFIRMATIONS.inc(result="confirmed")
+                else:
+                    db.execute(queries.UPDATE_RECHARGE_BLOCK, params)
+                    counts["pending"] += 1
+                db.commit()
+            metrics.RECHARGE_PENDING.set(counts["pending"])
+            return counts
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.check_pending)
+            except Exception as e:
+                logger.warning("Recharge confirmation check failed: %s", e)
+            await asyncio.sleep(self.interval)
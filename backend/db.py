@@ -0,0 +1,125 @@
+"""
+数据库连接池
+
+在 SQLAlchemy QueuePool 的基础上：
+1. 连接池大小 / 溢出 / 回收 / 等待超时可配置
+2. 用"空闲超过阈值才探活"代替 pool_pre_ping：pre_ping 每次 checkout 都多一次往返，
+   而热点连接刚被归还、不可能已失效；只有空闲较久的连接才可能被 MySQL wait_timeout
+   或中间网络设备断开，配合 pool_recycle 与 LIFO 取用，绝大多数 checkout 不需要探活
+3. 统计 checkout 等待时间、超时次数与连接池占用，用于按 worker 数量调整池大小
+4. 统计每条 SQL 的执行耗时（按 SELECT / INSERT / UPDATE / DELETE 分类）
+"""
+import time
+from typing import Optional
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+import metrics
+
+STATEMENT_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE"}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录 checkout 等待时间的 QueuePool"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.DB_POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            metrics.DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _install_liveness_check(engine: Engine, ping_idle: float) -> None:
+    """归还时记录时间；checkout 时连接空闲超过 ping_idle 秒才执行一次探活"""
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        connection_record.info["last_checkin"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        last_checkin = connection_record.info.get("last_checkin")
+        if last_checkin is None or time.monotonic() - last_checkin < ping_idle:
+            return
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+        except Exception as e:
+            # 抛出 DisconnectionError 后连接池会丢弃该连接并重新建立
+            metrics.DB_POOL_LIVENESS_PINGS.inc(result="dead")
+            raise exc.DisconnectionError(f"Stale pooled connection: {e}")
+        metrics.DB_POOL_LIVENESS_PINGS.inc(result="ok")
+
+
+def _install_statement_timer(engine: Engine) -> None:
+    """记录每条语句在数据库驱动上的执行耗时"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["statement_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("statement_started", None)
+        if started is not None:
+            words = statement.split(None, 1)
+            verb = words[0].upper() if words else "OTHER"
+            if verb not in STATEMENT_VERBS:
+                verb = "OTHER"
+            metrics.DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, verb=verb)
+
+
+def _register_pool_gauges(engine: Engine, pool_size: int, max_overflow: int) -> None:
+    pool = engine.pool
+    capacity = pool_size + max(max_overflow, 0)
+    metrics.DB_POOL_CONNECTIONS.set_function(pool.checkedout, state="checked_out")
+    metrics.DB_POOL_CONNECTIONS.set_function(pool.checkedin, state="idle")
+    metrics.DB_POOL_CONNECTIONS.set_function(lambda: capacity, state="capacity")
+    metrics.DB_POOL_SATURATION.set_function(lambda: pool.checkedout() / capacity if capacity else 0)
+
+
+def create_db_engine(
+    dsn: str,
+    pool_size: int = 10,
+    max_overflow: int = 10,
+    pool_recycle: int = 1800,
+    pool_timeout: float = 10.0,
+    ping_idle: float = 30.0,
+    connect_args: Optional[dict] = None,
+) -> Engine:
+    """
+    创建带连接池监控的 Engine
+
+    Args:
+        dsn: 数据库 DSN
+        pool_size: 常驻连接数
+        max_overflow: 高峰时额外允许的连接数
+        pool_recycle: 连接最长使用时间（秒），应小于 MySQL wait_timeout
+        pool_timeout: 连接池耗尽时等待 checkout 的最长时间（秒）
+        ping_idle: 连接空闲超过该秒数时 checkout 前探活，0 表示每次都探活
+        connect_args: 传给数据库驱动 connect() 的额外参数
+    """
+    engine = create_engine(
+        dsn,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_timeout=pool_timeout,
+        # LIFO：低峰期多余的连接保持空闲直到被回收，常用连接始终是"热"的
+        pool_use_lifo=True,
+        connect_args=connect_args or {},
+    )
+    _install_liveness_check(engine, ping_idle)
+    _install_statement_timer(engine)
+    _register_pool_gauges(engine, pool_size, max_overflow)
+    return engine
@@ -16,6 +16,8 @@ from decimal import Decimal
 from web3 import Web3
 from eth_account import Account
 from dotenv import load_dotenv
+
+from rpc_pool import make_web3
 import httpx
 
 # 加载环境变量
@@ -23,6 +25,7 @@ load_dotenv()
 
 # 配置
 RPC_URL = os.getenv("RPC_URL", "https://testnet-rpc.monad.xyz")
+RPC_URLS = [u.strip() for u in os.getenv("RPC_URLS", "").split(",") if u.strip()]  # 备用 RPC 节点（逗号分隔）
 CHAIN_ID = int(os.getenv("CHAIN_ID", "10143"))
 PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
@@ -81,7 +84,7 @@ def auto_recharge(amount: str, user_address: str = None):
         print(f"将使用私钥地址: {sender_address}")
     
     # 初始化 Web3
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
+    w3 = make_web3(RPC_URL, RPC_URLS)
     if not w3.is_connected():
         print(f"❌ 错误: 无法连接到 RPC: {RPC_URL}")
         return
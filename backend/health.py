@@ -0,0 +1,116 @@
+"""
+存活 / 就绪检查
+
+探针频率高、Pod 数量多时，每次探活都查一次 RPC 与 MySQL 会给两者带来可观的负载。
+这里把依赖检查放到后台任务里按固定间隔执行，探针只读取缓存的结果：
+
+- /livez：不做任何 I/O，只要事件循环能响应就返回 200
+- /readyz：返回最近一轮检查的结果（每个依赖的状态、耗时、错误）与连接池占用；
+  有依赖失败、结果过旧（后台任务卡住）或尚未完成第一轮检查时返回 503
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HealthChecker:
+    """后台定期执行依赖检查，缓存结果供探针读取"""
+
+    def __init__(
+        self,
+        checks: Dict[str, Callable[[], Optional[dict]]],
+        interval: float = 5.0,
+        timeout: float = 3.0,
+        pools: Optional[Dict[str, Callable[[], dict]]] = None,
+    ):
+        """
+        Args:
+            checks: 名称 -> 同步检查函数（在线程中执行），失败时抛异常，可返回附加信息
+            interval: 检查间隔（秒）
+            timeout: 单项检查超时（秒）
+            pools: 名称 -> 返回连接池占用信息的函数（输出时计算，不做 I/O）
+        """
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.pools = pools or {}
+        # 超过 3 个间隔没有新结果，说明后台任务卡住了
+        self.stale_after = max(interval * 3, timeout + interval)
+        self._results: Dict[str, dict] = {}
+        self._checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run_check(self, name: str, check: Callable) -> dict:
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(asyncio.to_thread(check), timeout=self.timeout)
+            result = {"status": "ok"}
+            if detail:
+                result.update(detail)
+        except asyncio.TimeoutError:
+            result = {"status": "fail", "error": f"timed out after {self.timeout}s"}
+        except Exception as e:
+            result = {"status": "fail", "error": str(e)}
+        elapsed = time.perf_counter() - started
+        result["latency_ms"] = round(elapsed * 1000, 2)
+        metrics.HEALTH_CHECK_SECONDS.observe(elapsed, check=name)
+        metrics.HEALTH_CHECK_UP.set(1 if result["status"] == "ok" else 0, check=name)
+        return result
+
+    async def run_once(self) -> None:
+        """并发执行一轮全部检查"""
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run_check(n, self.checks[n]) for n in names))
+        self._results = dict(zip(names, results))
+        self._checked_at = time.time()
+
+    def pool_usage(self) -> dict:
+        usage = {}
+        for name, fn in self.pools.items():
+            try:
+                usage[name] = fn()
+            except Exception as e:
+                usage[name] = {"error": str(e)}
+        return usage
+
+    def readiness(self) -> tuple[bool, dict]:
+        """返回 (是否就绪, 报告)，只读取缓存的结果"""
+        if self._checked_at is None:
+            return False, {"status": "starting", "checks": {}, "pools": self.pool_usage()}
+        age = time.time() - self._checked_at
+        stale = age > self.stale_after
+        ready = not stale and all(r["status"] == "ok" for r in self._results.values())
+        report = {
+            "status": "ready" if ready else "not_ready",
+            "checked_at": self._checked_at,
+            "age_seconds": round(age, 3),
+            "checks": self._results,
+            "pools": self.pool_usage(),
+        }
+        if stale:
+            report["error"] = f"health results are {age:.1f}s old"
+        return ready, report
+
+    async def start(self) -> None:
+        # 先完成一轮检查，启动后 /readyz 立即有结果
+        await self.run_once()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning("Health check round failed: %s", e)
@@ -0,0 +1,234 @@
+"""
+Idempotency-Key 支持
+
+客户端在网络错误后会重试同一个请求。带 Idempotency-Key 的请求：
+- 首次请求正常执行，成功的响应被记录下来（TTL 内可回放）
+- 执行中收到的重复请求等待原请求：非流式等结果，流式直接跟随原请求的 SSE 输出
+- 执行完成后收到的重复请求直接回放，不再扣费、不再请求上游 / 链上
+
+只记录成功响应；失败（上游错误、余额不足、客户端断开等）会释放 key，
+之后的重试重新执行。同一 key 配不同请求体视为客户端错误。
+
+响应体超过单条上限（max_entry_bytes）或存储总字节数超过 max_total_bytes 时不再缓冲响应体，
+但记录本身保留为只有状态与元数据的"墓碑"（truncated）：重试收到 409 与原响应状态，
+不会被当作新请求重新扣费、重新请求上游。总字节数超限时优先丢弃最早完成记录的响应体。
+
+存储在进程内存中，多 worker 部署时需要在负载均衡层按用户做会话保持。
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+
+import metrics
+
+
+class IdempotencyKeyMismatch(ValueError):
+    """同一 Idempotency-Key 被用于不同的请求体"""
+
+
+class IdempotencyEntry:
+    """一次请求的执行状态与响应记录"""
+
+    IN_FLIGHT = "in_flight"
+    COMPLETE = "complete"
+    FAILED = "failed"
+
+    def __init__(self, key: str, fingerprint: str, store: Optional["IdempotencyStore"] = None):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.state = self.IN_FLIGHT
+        self.status_code: Optional[int] = None
+        self.media_type: Optional[str] = None
+        self.chunks: list = []
+        self.size = 0
+        # 响应体过大或总字节数超限，已停止记录响应体（只保留状态与元数据）
+        self.truncated = False
+        self.expires_at = float("inf")
+        self._store = store
+        self._started = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    @property
+    def started(self) -> bool:
+        return self.status_code is not None
+
+    def start(self, status_code: int, media_type: str) -> None:
+        """原请求确定了响应状态，开始记录响应体"""
+        self.status_code = status_code
+        self.media_type = media_type
+        self._started.set()
+
+    def append(self, chunk) -> None:
+        if not self.truncated:
+            if self._store is None or self._store._charge(self, len(chunk)):
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+            else:
+                self.drop_body()
+        self._notify()
+
+    def drop_body(self) -> None:
+        """停止记录响应体并释放已记录的分块，之后的重试只能得到状态与元数据"""
+        if self._store is not None:
+            self._store._release(self.size)
+        self.truncated = True
+        self.chunks = []
+        self.size = 0
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def record(self, chunks: AsyncIterator) -> AsyncIterator:
+        """转发原请求的流式响应，同时记录每个分块"""
+        try:
+            async for chunk in chunks:
+                self.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def replay(self, on_fail=None) -> AsyncIterator:
+        """
+        回放响应：已记录的分块立即输出，原请求仍在进行时等待后续分块
+
+        Args:
+            on_fail: 原请求中途失败时追加输出的分块
+        """
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            # 响应体已被丢弃：无法继续回放，按中途失败结束
+            if self.state == self.FAILED or self.truncated:
+                if on_fail is not None:
+                    yield on_fail
+                return
+            if self.state == self.COMPLETE:
+                return
+            await changed.wait()
+
+
+class IdempotencyStore:
+    """有界、带 TTL 的幂等结果存储（条数与响应体总字节数都有上限）"""
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl: float = 86400.0,
+        max_entry_bytes: int = 4 * 1024 * 1024,
+        max_total_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.max_total_bytes = max_total_bytes
+        self._entries: "OrderedDict[str, IdempotencyEntry]" = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def _charge(self, entry: IdempotencyEntry, size: int) -> bool:
+        """
+        为 entry 再记录 size 字节申请额度
+
+        单条超过 max_entry_bytes 时拒绝；总量超限时先丢弃最早完成记录的响应体，仍不够再拒绝。
+        """
+        if entry.size + size > self.max_entry_bytes:
+            return False
+        if self._bytes + size > self.max_total_bytes:
+            for other in self._entries.values():
+                if self._bytes + size <= self.max_total_bytes:
+                    break
+                if other.state == IdempotencyEntry.COMPLETE and other.size:
+                    other.drop_body()
+            if self._bytes + size > self.max_total_bytes:
+                return False
+        self._bytes += size
+        return True
+
+    def _release(self, size: int) -> None:
+        self._bytes -= size
+
+    @staticmethod
+    def fingerprint(body: bytes) -> str:
+        return hashlib.sha256(body).hexdigest()
+
+    def _purge(self) -> None:
+        """清理过期记录；超出条数上限时淘汰最早完成的记录（进行中的不淘汰）"""
+        now = time.monotonic()
+        overflow = len(self._entries) - self.max_entries
+        for key, entry in list(self._entries.items()):
+            if entry.state == IdempotencyEntry.IN_FLIGHT:
+                continue
+            if entry.expires_at > now and overflow <= 0:
+                break
+            del self._entries[key]
+            self._release(entry.size)
+            overflow -= 1
+
+    async def acquire(self, scope: str, user: str, key: str, body: bytes, timeout: float):
+        """
+        获取 key 的执行权
+
+        Returns:
+            (entry, owner)：owner 为 True 时由调用方执行请求并调用 finish()；
+            否则 entry 已开始输出响应（可能仍在进行），调用方回放即可；
+            entry.truncated 为 True 时响应体未保留，调用方只能返回状态（不能重新执行）
+
+        Raises:
+            IdempotencyKeyMismatch: key 已用于不同的请求体
+            asyncio.TimeoutError: 等待原请求超时
+        """
+        full_key = f"{scope}:{(user or '').lower()}:{key}"
+        fingerprint = self.fingerprint(body)
+        deadline = time.monotonic() + timeout
+        while True:
+            self._purge()
+            entry = self._entries.get(full_key)
+            if entry is None:
+                entry = IdempotencyEntry(full_key, fingerprint, self)
+                self._entries[full_key] = entry
+                metrics.IDEMPOTENCY_REQUESTS.inc(scope=scope, result="new")
+                return entry, True
+            if entry.fingerprint != fingerprint:
+                metrics.IDEMPOTENCY_REQUESTS.inc(scope=scope, result="mismatch")
+                raise IdempotencyKeyMismatch(f"Idempotency-Key '{key}' was used with a different request body")
+            if entry.started:
+                if entry.truncated:
+                    result = "unavailable"
+                else:
+                    result = "replay" if entry.state == IdempotencyEntry.COMPLETE else "follow"
+                metrics.IDEMPOTENCY_REQUESTS.inc(scope=scope, result=result)
+                return entry, False
+            # 原请求尚未产生响应：等待开始或失败（失败时重新竞争执行权）
+            await asyncio.wait_for(entry._started.wait(), deadline - time.monotonic())
+
+    def finish(self, entry: IdempotencyEntry, ok: bool) -> None:
+        """
+        结束原请求：成功时保留记录供回放（响应体已丢弃时保留为墓碑），失败时释放 key
+
+        重复调用是安全的（只有第一次生效）。
+        """
+        if entry.state != IdempotencyEntry.IN_FLIGHT:
+            return
+        entry.state = IdempotencyEntry.COMPLETE if ok and entry.started else IdempotencyEntry.FAILED
+        if entry.state == IdempotencyEntry.COMPLETE:
+            entry.expires_at = time.monotonic() + self.ttl
+            if entry.key in self._entries:
+                self._entries.move_to_end(entry.key)
+        else:
+            # 正在跟随的请求仍持有分块引用，这里只归还额度，分块随最后一个跟随者结束释放
+            self._release(entry.size)
+            entry.size = 0
+            if self._entries.get(entry.key) is entry:
+                del self._entries[entry.key]
+        # 唤醒等待者：未开始即失败的请求让等待者重新竞争执行权
+        entry._started.set()
+        entry._notify()
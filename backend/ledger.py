@@ -0,0 +1,321 @@
+"""
+余额事件账本（只追加）
+
+user_balances.balance 被扣费和充值原地更新，热点用户的余额行成为锁竞争点，
+且扣费没有任何历史记录。账本把每次余额变化追加为 balance_events 中的一行：
+
+- credit：充值入账（+amount，ref 为 tx_hash），与充值记录在同一事务中写入
+- reserve：请求前预扣（-预估费用，ref 为请求 ID）；primary 模式下在请求中同步提交后才生效，
+  shadow 模式下（user_balances 已扣费）批量异步写入
+- settle：请求结束后的实际消耗（amount 为实际费用，不计入余额），批量异步写入
+- refund：退还预扣与实际消耗的差额（+amount，primary 模式且开启 refund_unused 时，或客户端中途断开时写入）
+- reversal：充值交易被 reorg 移出链后撤销入账（-amount，ref 为 tx_hash）
+
+当前余额 = 最新快照 + 快照之后除 settle 以外事件的和；快照由后台任务定期生成，
+对账只需按 (user_address, id) 索引顺序扫描。
+
+运行模式（BALANCE_LEDGER）：
+- off：不写账本（默认）
+- shadow：仍以 user_balances 为准，同时写账本（多 worker 安全，用于积累历史与对账）
+- primary：以账本为准，不再更新 user_balances 热点行；余额缓存在进程内，
+  要求所有扣费/充值由同一个进程处理（单 worker）：WEB_CONCURRENCY > 1 时拒绝启动，
+  否则每个 worker 按各自缓存的余额预扣，同一笔资金会被重复花掉
+
+批量写入的事件（settle、refund、shadow 模式的 reserve）在进程崩溃时最多丢失最近一个 flush_interval 的数据，
+都不会让余额变多：settle 不计入余额，丢失 refund 只会少退款。数据库长时间不可用时待写队列
+超过 max_pending 后丢弃最早的事件（ledger_events_dropped_total）。
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+import metrics
+import queries
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "shadow", "primary")
+
+
+class BalanceLedger:
+    """余额事件账本：批量写入 + 定期快照 + primary 模式下的进程内余额缓存"""
+
+    def __init__(
+        self,
+        session_factory,
+        mode: str = "off",
+        flush_interval: float = 0.05,
+        batch_size: int = 500,
+        snapshot_interval: float = 300.0,
+        refund_unused: bool = False,
+        max_pending: int = 100_000,
+        snapshot_lock_timeout: int = 1,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Invalid ledger mode: {mode}")
+        if mode == "primary" and int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1:
+            raise ValueError("BALANCE_LEDGER=primary requires a single worker (WEB_CONCURRENCY=1)")
+        self.session_factory = session_factory
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.snapshot_interval = snapshot_interval
+        self.refund_unused = refund_unused
+        self.max_pending = max_pending
+        self.snapshot_lock_timeout = snapshot_lock_timeout
+
+        self._pending: list[dict] = []
+        self._balances: dict[str, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: list[asyncio.Task] = []
+        self._snapshot_watermark: Optional[int] = None
+        metrics.LEDGER_PENDING_EVENTS.set_function(lambda: len(self._pending))
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def primary(self) -> bool:
+        return self.mode == "primary"
+
+    # ---------- 生命周期 ----------
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._snapshot_loop()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pending:
+            await self.flush()
+
+    # ---------- 余额 ----------
+
+    def _load_balance(self, db, user_address: str) -> Optional[int]:
+        """从数据库计算余额：最新快照 + 之后的事件；用户不存在时返回 None"""
+        snapshot = db.execute(queries.SELECT_LATEST_SNAPSHOT, {"u": user_address}).first()
+        base, after = (int(snapshot[0]), int(snapshot[1])) if snapshot else (0, 0)
+        tail, count = db.execute(queries.SUM_EVENTS_AFTER, {"u": user_address, "after": after}).first()
+        db.commit()
+        if snapshot is None and not count:
+            return None
+        return base + int(tail)
+
+    def balance(self, db, user_address: str) -> Optional[int]:
+        """primary 模式下的当前余额（首次访问从数据库加载，之后由本进程维护）"""
+        if user_address not in self._balances:
+            loaded = self._load_balance(db, user_address)
+            if loaded is None:
+                return None
+            # 加载期间其他协程可能已经填充（同步调用，不会交错，这里只是防御）
+            self._balances.setdefault(user_address, loaded)
+        return self._balances[user_address]
+
+    # ---------- 事件 ----------
+
+    def _append(self, user_address: str, kind: str, amount: int, ref: Optional[str]) -> None:
+        self._pending.append({"u": user_address, "k": kind, "a": amount, "r": ref})
+        metrics.LEDGER_EVENTS.inc(kind=kind)
+        self._trim_pending()
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _trim_pending(self) -> None:
+        """待写队列超过 max_pending 时丢弃最早的事件（数据库长时间不可用时限制内存）"""
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            metrics.LEDGER_EVENTS_DROPPED.inc(overflow)
+            logger.error("Ledger pending queue full, dropped %d oldest events", overflow)
+
+    def reserve(self, db, user_address: str, amount: int, ref: str) -> tuple[bool, Optional[int]]:
+        """
+        primary 模式：检查余额并预扣
+
+        reserve 事件在调用方 Session 中插入并提交后才更新进程内余额：进程崩溃不会丢失已生效的扣费
+        （重启后从快照 + 事件重新计算的余额不会比实际高）。检查到更新之间没有 await，同一进程内不会交错。
+
+        Returns:
+            (是否成功, 预扣前余额；用户不存在时为 None)
+        """
+        current = self.balance(db, user_address)
+        if current is None or current < amount:
+            return False, current
+        try:
+            db.execute(queries.INSERT_BALANCE_EVENT, {"u": user_address, "k": "reserve", "a": -amount, "r": ref})
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        metrics.LEDGER_EVENTS.inc(kind="reserve")
+        self._balances[user_address] = current - amount
+        return True, current
+
+    def record_reserve(self, user_address: str, amount: int, ref: str) -> None:
+        """shadow 模式：user_balances 扣费成功后追加 reserve 事件"""
+        self._append(user_address, "reserve", -amount, ref)
+
+    def write_credit(self, db, user_address: str, amount: int, ref: Optional[str]) -> None:
+        """在调用方事务中写入 credit 事件（充值必须与充值记录一起持久化，不走批量）"""
+        db.execute(queries.INSERT_BALANCE_EVENT, {"u": user_address, "k": "credit", "a": amount, "r": ref})
+        metrics.LEDGER_EVENTS.inc(kind="credit")
+
+    def write_reversal(self, db, user_address: str, amount: int, ref: Optional[str]) -> None:
+        """在调用方事务中写入 reversal 事件（reorg 后撤销充值，-amount）"""
+        db.execute(queries.INSERT_BALANCE_EVENT, {"u": user_address, "k": "reversal", "a": -amount, "r": ref})
+        metrics.LEDGER_EVENTS.inc(kind="reversal")
+
+    def apply_credit(self, db, user_address: str, amount: int) -> int:
+        """credit / reversal 事务提交后更新缓存（reversal 传负数），返回最新余额（primary 模式）"""
+        if user_address in self._balances:
+            self._balances[user_address] += amount
+        else:
+            self._balances[user_address] = self._load_balance(db, user_address) or 0
+        return self._balances[user_address]
+
+    def settle(
+        self, user_address: str, ref: str, reserved: int, actual: int, refund: Optional[bool] = None
+    ) -> None:
+        """
+        请求结束：记录实际消耗，需要时写入 refund 退还差额
+
+        Args:
+            reserved: 预扣金额（wei）
+            actual: 按真实 usage 计算的费用（wei）
+            refund: 是否退还差额；None 时仅 primary 模式且开启 refund_unused 时退还。
+                客户端中途断开时调用方传 True（非 primary 模式由调用方同时退回 user_balances，
+                账本也写 refund，两者保持一致）
+        """
+        if refund is None:
+            refund = self.primary and self.refund_unused
+        self._append(user_address, "settle", actual, ref)
+        if refund and actual < reserved:
+            self._append(user_address, "refund", reserved - actual, ref)
+            if self.primary and user_address in self._balances:
+                self._balances[user_address] += reserved - actual
+
+    # ---------- 批量写入 ----------
+
+    def _write_batch(self, batch: list[dict]) -> None:
+        db = self.session_factory()
+        try:
+            db.execute(queries.INSERT_BALANCE_EVENT, batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def flush(self) -> int:
+        """把待写事件一次性批量插入；失败时放回队列等待下次重试"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, []
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write_batch, batch)
+        except Exception as e:
+            self._pending[:0] = batch
+            self._trim_pending()
+            metrics.LEDGER_FLUSH_ERRORS.inc()
+            logger.warning("Ledger flush failed (%d events pending): %s", len(batch), e)
+            return 0
+        metrics.LEDGER_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        return len(batch)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # ---------- 快照 ----------
+
+    def _committed_max_event_id(self, db) -> int:
+        """
+        已确认全部提交的最大事件 ID：不会再有更小 ID 的事件在之后提交
+
+        MySQL 的 AUTO_INCREMENT ID 在插入时分配，较小的 ID 可能晚于较大的 ID 提交；
+        LOCK TABLES ... READ 要等所有写过 balance_events 的事务结束（它们持有元数据锁直到提交），
+        之后读到的 MAX(id) 以内都已提交。等待超过 snapshot_lock_timeout 秒时本轮失败，下一轮重试，
+        写入最多被阻塞这么久。SQLite 同一时刻只有一个写事务，未提交的事件 ID 一定大于已提交的，
+        直接读取即可。
+        """
+        if db.get_bind().dialect.name != "mysql":
+            return int(db.execute(queries.SELECT_MAX_EVENT_ID).scalar())
+        db.execute(queries.SET_LOCK_WAIT_TIMEOUT, {"t": self.snapshot_lock_timeout})
+        try:
+            db.execute(queries.LOCK_EVENTS_READ)
+            try:
+                return int(db.execute(queries.SELECT_MAX_EVENT_ID).scalar())
+            finally:
+                db.execute(queries.UNLOCK_TABLES)
+        finally:
+            db.execute(queries.RESET_LOCK_WAIT_TIMEOUT)
+
+    def _write_snapshots(self) -> int:
+        """为有新事件的用户生成快照，只汇总到已确认全部提交的最大事件 ID（upto）"""
+        db = self.session_factory()
+        try:
+            if self._snapshot_watermark is None:
+                self._snapshot_watermark = int(db.execute(queries.SELECT_SNAPSHOT_WATERMARK).scalar())
+            upto = self._committed_max_event_id(db)
+            if upto <= self._snapshot_watermark:
+                db.commit()
+                return 0
+
+            users = [
+                row[0]
+                for row in db.execute(
+                    queries.SELECT_USERS_WITH_EVENTS_BETWEEN,
+                    {"after": self._snapshot_watermark, "upto": upto},
+                )
+            ]
+            written = 0
+            for user_address in users:
+                snapshot = db.execute(queries.SELECT_LATEST_SNAPSHOT, {"u": user_address}).first()
+                base, after = (int(snapshot[0]), int(snapshot[1])) if snapshot else (0, 0)
+                if after >= upto:
+                    continue
+                tail = db.execute(
+                    queries.SUM_EVENTS_BETWEEN, {"u": user_address, "after": after, "upto": upto}
+                ).scalar()
+                db.execute(queries.INSERT_SNAPSHOT, {"u": user_address, "id": upto, "b": base + int(tail)})
+                written += 1
+            db.commit()
+            self._snapshot_watermark = upto
+            return written
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def snapshot(self) -> int:
+        return await asyncio.to_thread(self._write_snapshots)
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            try:
+                written = await self.snapshot()
+                if written:
+                    logger.info("Ledger snapshots written: %d users", written)
+            except Exception as e:
+                logger.warning("Ledger snapshot failed: %s", e)
+            await asyncio.sleep(self.snapshot_interval)
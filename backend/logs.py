@@ -0,0 +1,218 @@
+"""
+结构化异步日志
+
+请求路径上的 print 直接同步写 stdout，日志管道变慢（容器日志驱动、终端）时会阻塞事件循环。
+这里把标准库 logging 接成：
+
+1. 调用方只构造 LogRecord 并放入有界队列（QueueHandler），不做 I/O；队列满时丢弃并计数，
+   日志量再大也不会拖慢请求
+2. 后台线程（QueueListener）取出记录，格式化为单行 JSON（或文本）写到 stdout
+3. 每条日志带上当前请求的 request_id（RequestIdMiddleware 从 X-Request-ID 读取或生成，并写回响应头）
+4. 按模块设置级别（LOG_LEVELS="ledger=DEBUG,rpc_pool=WARNING"）
+5. 高频事件按 extra={"event": ...} 采样（LOG_SAMPLING="usage=0.01"）
+
+用法：模块内 logger = logging.getLogger(__name__)，结构化字段通过 extra 传入。
+"""
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import metrics
+
+# 当前请求的 ID（由 RequestIdMiddleware 设置，后台任务中为 None）
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord 自带的属性，其余属性都是调用方通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+
+# httpx 每个请求都会打一条 INFO，默认只保留警告（可用 LOG_LEVELS 覆盖）
+DEFAULT_MODULE_LEVELS = {"httpx": "WARNING", "httpcore": "WARNING"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """单行 JSON：ts / level / logger / msg / request_id + extra 字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """本地开发用的文本格式，extra 字段以 key=value 附在末尾"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(rid)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.rid = f" [{record.request_id}]" if getattr(record, "request_id", None) else ""
+        fields = " ".join(
+            f"{k}={v}" for k, v in record.__dict__.items() if k not in _RECORD_ATTRS and k != "rid" and not k.startswith("_")
+        )
+        line = super().format(record)
+        return f"{line} {fields}" if fields else line
+
+
+class ContextFilter(logging.Filter):
+    """附加 request_id，并按事件采样"""
+
+    def __init__(self, sampling: Optional[dict] = None):
+        super().__init__()
+        self.sampling = sampling or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sampling.get(getattr(record, "event", None))
+        if rate is not None and rate < 1 and random.random() >= rate:
+            metrics.LOG_RECORDS_SAMPLED_OUT.inc(event=record.event)
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """放入有界队列，队列满时丢弃；格式化留给后台线程"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用方线程里固定消息与异常文本（参数对象之后可能被修改），不做 JSON 序列化
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class DrainingQueueListener(QueueListener):
+    """停止时等待队列有空位再放入结束标记（默认的 put_nowait 在队列满时会抛 Full）"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def parse_levels(value: str) -> dict:
+    """解析 "ledger=DEBUG,rpc_pool=WARNING" 形式的按模块级别"""
+    levels = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_sampling(value: str) -> dict:
+    """解析 "usage=0.01" 形式的事件采样率"""
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            event, rate = item.split("=", 1)
+            rates[event.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(
+    level: str = "INFO",
+    module_levels: Optional[dict] = None,
+    fmt: str = "json",
+    sampling: Optional[dict] = None,
+    queue_size: int = 10000,
+) -> None:
+    """
+    配置根 logger：有界队列 + 后台线程写 stdout（重复调用时先停止旧的后台线程）
+
+    Args:
+        level: 默认级别
+        module_levels: logger 名称 -> 级别
+        fmt: json / text
+        sampling: 事件名 -> 采样率（0~1）
+        queue_size: 队列容量，满时丢弃新日志
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(sampling))
+    metrics.LOG_QUEUE_DEPTH.set_function(log_queue.qsize)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, module_level in {**DEFAULT_MODULE_LEVELS, **(module_levels or {})}.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = DrainingQueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """写完队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+class RequestIdMiddleware:
+    """ASGI 中间件：读取或生成 X-Request-ID，设置到日志上下文并写回响应头"""
+
+    def __init__(self, app, header: str = "x-request-id"):
+        self.app = app
+        self.header = header.encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == self.header:
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + [(self.header, request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
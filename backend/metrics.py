@@ -0,0 +1,557 @@
+"""
+进程内轻量级指标（Prometheus 文本格式）
+
+只依赖标准库，热路径上每次记录仅是一次加锁的字典累加（直方图多一次二分查找）。
+通过 main.py 中的 GET /metrics 暴露。
+"""
+import bisect
+import threading
+from typing import Callable, Dict, Tuple
+
+
+class Counter:
+    """单调递增计数器，支持标签"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines)
+
+
+class Gauge:
+    """可增减的瞬时值；也可以注册回调，在输出时计算（如连接池占用）"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels) -> None:
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        fn = self._functions.get(key)
+        return fn() if fn is not None else self._values.get(key, 0)
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                items.append((key, fn()))
+            except Exception:
+                continue
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines)
+
+
+# 默认桶（秒），覆盖 1ms ~ 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """累积分桶直方图（_bucket / _sum / _count）"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数..., sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        state = self._values.get(key)
+        return state[-1] if state else 0
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_bound(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            base = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base} {state[-2]}")
+            lines.append(f"{self.name}_count{base} {state[-1]}")
+        return "\n".join(lines)
+
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class LabelLimiter:
+    """
+    限制来自请求的标签值（如 model）的基数：
+
+    只接受短的、由字母数字与 .-_ 组成的值，最多记录 max_values 个不同值，其余归为 "other"
+    """
+
+    def __init__(self, max_values: int = 50):
+        self.max_values = max_values
+        self._seen: set = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, value) -> str:
+        if not value:
+            return "unknown"
+        if value in self._seen:
+            return value
+        if not isinstance(value, str) or len(value) > 64 or not value.replace(".", "").replace("-", "").replace("_", "").isalnum():
+            return "other"
+        with self._lock:
+            if len(self._seen) >= self.max_values:
+                return "other"
+            self._seen.add(value)
+        return value
+
+
+REGISTRY: list = []
+
+
+def render_latest() -> str:
+    """按 Prometheus 文本格式输出所有已注册指标"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# ========== Claude 代理 ==========
+
+# model 标签来自客户端请求，限制不同值的数量
+CLAUDE_MODEL_LABEL = LabelLimiter(max_values=50)
+
+CLAUDE_CLIENT_DISCONNECTS = Counter(
+    "claude_client_disconnects_total",
+    "Client disconnects before the proxied response completed",
+    ("mode",),
+)
+
+CLAUDE_DISCONNECT_REFUNDED_TOKENS = Counter(
+    "claude_disconnect_refunded_tokens_total",
+    "Reserved tokens returned to users after a mid-stream disconnect (reserved - partial usage)",
+)
+
+CLAUDE_UPSTREAM_RETRIES = Counter(
+    "claude_upstream_retries_total",
+    "Upstream attempts retried before the first byte reached the client",
+    ("reason",),
+)
+
+CLAUDE_UPSTREAM_HEDGES = Counter(
+    "claude_upstream_hedges_total",
+    "Hedged non-stream upstream requests",
+    ("outcome",),
+)
+
+CLAUDE_UPSTREAM_TIMEOUTS = Counter(
+    "claude_upstream_timeouts_total",
+    "Upstream timeouts by budget (connect, first_byte, idle, total)",
+    ("kind",),
+)
+
+CLAUDE_SSE_PINGS = Counter(
+    "claude_sse_pings_total",
+    "Keep-alive ping events sent to clients during upstream pauses",
+)
+
+CLAUDE_PROMPT_REF_LOOKUPS = Counter(
+    "claude_prompt_ref_lookups_total",
+    "tools_ref / system_ref lookups by result (memory, disk, miss)",
+    ("result",),
+)
+
+CLAUDE_PROMPT_REF_BYTES_EXPANDED = Counter(
+    "claude_prompt_ref_bytes_expanded_total",
+    "Bytes of tools/system content expanded from refs instead of being sent by clients",
+)
+
+CLAUDE_PROMPT_REF_DISK_EVICTIONS = Counter(
+    "claude_prompt_ref_disk_evictions_total",
+    "Prompt ref files deleted because PROMPT_REF_DIR exceeded PROMPT_REF_DIR_MAX_BYTES",
+)
+
+CLAUDE_PROMPT_CACHE_BREAKPOINTS = Counter(
+    "claude_prompt_cache_breakpoints_total",
+    "cache_control breakpoints injected by the proxy",
+)
+
+CLAUDE_REQUESTS = Counter(
+    "claude_requests_total",
+    "/v1/messages requests that reached billing, by model and mode (stream / non_stream)",
+    ("model", "mode"),
+)
+
+CLAUDE_PAYMENT_REQUIRED = Counter(
+    "claude_payment_required_total",
+    "/v1/messages requests rejected with 402, by reason",
+    ("reason",),
+)
+
+CLAUDE_BALANCE_CHECK_SECONDS = Histogram(
+    "claude_balance_check_seconds",
+    "check_and_deduct_balance latency",
+    ("result",),
+)
+
+CLAUDE_UPSTREAM_TTFB = Histogram(
+    "claude_upstream_ttfb_seconds",
+    "Time from forwarding to the first upstream SSE line (stream) or full response (non_stream)",
+    ("model", "mode"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+
+CLAUDE_UPSTREAM_DURATION = Histogram(
+    "claude_upstream_duration_seconds",
+    "Total proxied upstream duration until the response finished",
+    ("model", "mode"),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+
+CLAUDE_SSE_EVENTS = Counter(
+    "claude_sse_events_forwarded_total",
+    "SSE events forwarded to clients",
+    ("model",),
+)
+
+CLAUDE_SSE_BYTES = Counter(
+    "claude_sse_bytes_forwarded_total",
+    "SSE bytes forwarded to clients (before compression)",
+    ("model",),
+)
+
+CLAUDE_TOKENS_RESERVED = Counter(
+    "claude_tokens_reserved_total",
+    "Tokens reserved up front (max_tokens x 1.2)",
+)
+
+CLAUDE_TOKENS_BILLED = Counter(
+    "claude_tokens_billed_total",
+    "Tokens reported by upstream usage (input + output + cache)",
+)
+
+CLAUDE_INPUT_TOKENS = Counter(
+    "claude_input_tokens_total",
+    "Upstream input tokens by kind, split by whether breakpoints were auto-injected",
+    ("kind", "auto_cache"),
+)
+
+CLAUDE_USAGE_REQUESTS = Counter(
+    "claude_usage_requests_total",
+    "Proxied requests with recorded usage",
+    ("auto_cache",),
+)
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total",
+    "Requests carrying an Idempotency-Key by outcome (new/replay/follow/unavailable/mismatch)",
+    ("scope", "result"),
+)
+
+IDEMPOTENCY_STORE_BYTES = Gauge(
+    "idempotency_store_bytes",
+    "Response bytes held by the Idempotency-Key store",
+)
+
+# ========== 数据库连接池 ==========
+
+DB_STATEMENT_SECONDS = Histogram(
+    "db_statement_seconds",
+    "SQL statement execution latency by verb",
+    ("verb",),
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled DB connection",
+)
+
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "DB connection checkouts that timed out waiting for the pool",
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "DB pool connections by state (checked_out/idle/capacity)",
+    ("state",),
+)
+
+DB_POOL_SATURATION = Gauge(
+    "db_pool_saturation_ratio",
+    "Checked-out connections divided by pool_size + max_overflow",
+)
+
+DB_POOL_LIVENESS_PINGS = Counter(
+    "db_pool_liveness_pings_total",
+    "Liveness pings issued for connections idle longer than the ping threshold",
+    ("result",),
+)
+
+# ========== 余额账本 ==========
+
+LEDGER_EVENTS = Counter(
+    "ledger_events_total",
+    "Balance events appended to the ledger",
+    ("kind",),
+)
+
+LEDGER_FLUSH_SECONDS = Histogram(
+    "ledger_flush_seconds",
+    "Time to batch-insert pending balance events",
+)
+
+LEDGER_FLUSH_ERRORS = Counter(
+    "ledger_flush_errors_total",
+    "Failed balance event batch inserts (events are retried)",
+)
+
+LEDGER_PENDING_EVENTS = Gauge(
+    "ledger_pending_events",
+    "Balance events waiting to be flushed",
+)
+
+LEDGER_EVENTS_DROPPED = Counter(
+    "ledger_events_dropped_total",
+    "Batched balance events dropped because the pending queue exceeded LEDGER_MAX_PENDING",
+)
+
+# ========== 热点账户余额分片 ==========
+
+BALANCE_SHARD_DEBITS = Counter(
+    "balance_shard_debits_total",
+    "Debits against sharded balances by outcome (shard/main/rebalanced/rebalance_failed/insufficient)",
+    ("result",),
+)
+
+BALANCE_SHARD_DEBIT_ATTEMPTS = Counter(
+    "balance_shard_debit_attempts_total",
+    "Conditional UPDATEs issued while looking for a shard with enough funds",
+)
+
+BALANCE_SHARD_REBALANCES = Counter(
+    "balance_shard_rebalances_total",
+    "Per-user redistributions of funds across balance shards",
+    ("reason",),
+)
+
+# ========== 链上对账 ==========
+
+RECONCILE_RPC_CALLS = Counter(
+    "reconcile_rpc_calls_total",
+    "JSON-RPC calls issued by the reconciliation scanner by method and result",
+    ("method", "result"),
+)
+
+RECONCILE_DIFFS = Counter(
+    "reconcile_diffs_total",
+    "Reconciliation differences found (missing/extra/amount_mismatch)",
+    ("kind",),
+)
+
+# ========== 充值确认 ==========
+
+RECHARGE_CONFIRMATIONS = Counter(
+    "recharge_confirmations_total",
+    "Pending recharge outcomes (confirmed/reorged/reversed)",
+    ("result",),
+)
+
+RECHARGE_PENDING = Gauge(
+    "recharge_pending",
+    "Provisionally credited recharges awaiting confirmation depth",
+)
+
+# ========== RPC 节点池 ==========
+
+RPC_REQUESTS = Counter(
+    "rpc_requests_total",
+    "JSON-RPC requests sent through the provider pool by endpoint and result (ok/failure)",
+    ("endpoint", "result"),
+)
+
+RPC_LATENCY = Histogram(
+    "rpc_request_seconds",
+    "JSON-RPC request latency by endpoint and method",
+    ("endpoint", "method"),
+)
+
+RPC_FAILOVERS = Counter(
+    "rpc_failovers_total",
+    "Read requests retried on the next endpoint after an endpoint failure",
+)
+
+RPC_ENDPOINT_LATENCY = Gauge(
+    "rpc_endpoint_latency_ewma_seconds",
+    "Smoothed latency used to rank RPC endpoints",
+    ("endpoint",),
+)
+
+RPC_ENDPOINT_HEALTHY = Gauge(
+    "rpc_endpoint_healthy",
+    "1 if the RPC endpoint is not in failure cooldown",
+    ("endpoint",),
+)
+
+CHAIN_PAYMENT_SECONDS = Histogram(
+    "chain_payment_seconds",
+    "On-chain payment duration from balance check to receipt (facilitator / service / user wallet)",
+    ("payer", "result"),
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+
+# ========== 链上状态缓存 ==========
+
+CHAIN_CACHE_REQUESTS = Counter(
+    "chain_cache_requests_total",
+    "Chain state cache reads (hit / coalesced / miss / stale; nonce also resync)",
+    ("cache", "key", "result"),
+)
+
+CHAIN_CACHE_REFRESH_ERRORS = Counter(
+    "chain_cache_refresh_errors_total",
+    "Failed chain state refreshes",
+    ("cache", "key"),
+)
+
+CHAIN_CACHE_AGE = Gauge(
+    "chain_cache_age_seconds",
+    "Seconds since the cached chain value was last refreshed",
+    ("cache", "key"),
+)
+
+# ========== 健康检查 ==========
+
+HEALTH_CHECK_SECONDS = Histogram(
+    "health_check_seconds",
+    "Background dependency health check latency",
+    ("check",),
+)
+
+HEALTH_CHECK_UP = Gauge(
+    "health_check_up",
+    "1 if the last background health check of the dependency succeeded",
+    ("check",),
+)
+
+# ========== 日志 ==========
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+)
+
+LOG_RECORDS_SAMPLED_OUT = Counter(
+    "log_records_sampled_out_total",
+    "High-volume log records skipped by sampling, by event",
+    ("event",),
+)
+
+LOG_QUEUE_DEPTH = Gauge(
+    "log_queue_depth",
+    "Log records waiting for the background writer",
+)
+
+# ========== 性能剖析 ==========
+
+SLOW_REQUESTS = Counter(
+    "slow_requests_total",
+    "Requests whose time to first response byte exceeded SLOW_REQUEST_THRESHOLD",
+)
+
+PROFILES = Counter(
+    "profiles_total",
+    "On-demand sampling profiles, by result",
+    ("result",),
+)
@@ -0,0 +1,372 @@
+"""
+运行时性能剖析
+
+线上延迟升高时，在不重启、不挂调试器的情况下查看 worker 在做什么：
+
+1. SamplingProfiler：按需的采样剖析。后台线程按固定间隔读取所有线程的调用栈（sys._current_frames），
+   持续指定秒数后输出 speedscope JSON（https://www.speedscope.app 直接打开）或
+   collapsed 文本（flamegraph.pl / speedscope 均可导入）。只读取栈，不插桩，被测代码不变慢；
+   采样时按调用栈累加次数与耗时，内存只随不同栈的数量增长，与采样时长无关；
+   同一时间只允许一个剖析
+2. SlowRequestRecorder：首字节耗时超过阈值的请求，记录阶段耗时（tracing.span 埋点按名称累加）与
+   进行中的调用栈快照（请求协程挂起在哪里 + 事件循环线程正在执行什么），保存在有界环形缓冲区中
+
+首字节耗时（收到请求到发出响应头）对流式请求同样有意义：流本身持续多久不算慢请求。
+"""
+import asyncio
+import collections
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+import metrics
+import tracing
+from logs import request_id_var
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(Exception):
+    """已有剖析在进行中"""
+
+
+def _frame_key(frame) -> tuple:
+    code = frame.f_code
+    return (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+
+
+def _short_path(filename: str) -> str:
+    """site-packages 下的文件只保留包内路径，便于阅读"""
+    marker = f"site-packages{os.sep}"
+    index = filename.rfind(marker)
+    return filename[index + len(marker):] if index >= 0 else filename
+
+
+class SamplingProfiler:
+    """按需采样剖析（同一时间只允许一个）"""
+
+    def __init__(self, max_seconds: float = 60.0, min_interval: float = 0.005):
+        """
+        Args:
+            max_seconds: 单次剖析最长时间
+            min_interval: 最小采样间隔（秒），过小时采样线程本身会抢占 GIL
+        """
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+
+    def run(self, seconds: float, interval: float = 0.01) -> dict:
+        """
+        阻塞采样 seconds 秒（在线程中调用），返回原始采样结果
+
+        Raises:
+            ValueError: seconds / interval 不是有限数
+            ProfilerBusy: 已有剖析在进行中
+
+        Returns:
+            {"duration": 实际秒数, "interval": 采样间隔, "samples": 采样次数,
+             "threads": {线程名: [(栈（根在前，元素为 _frame_key）, 采样次数, 累计秒数), ...]}}
+        """
+        # NaN 时长永远达不到截止时间（采样线程一直持有锁），NaN 间隔会让 sleep 报错；inf 也一并拒绝
+        if not math.isfinite(seconds) or not math.isfinite(interval):
+            raise ValueError("seconds and interval must be finite numbers")
+        seconds = min(max(seconds, 0.0), self.max_seconds)
+        interval = max(interval, self.min_interval)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("a profile is already running")
+        try:
+            return self._sample(seconds, interval)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float) -> dict:
+        me = threading.get_ident()
+        names = {}
+        # 线程名 -> 栈 -> 采样次数 / 累计秒数
+        counts = collections.defaultdict(collections.Counter)
+        weights = collections.defaultdict(collections.Counter)
+        samples = 0
+        started = last = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            now = time.perf_counter()
+            weight, last = now - last, now
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_key(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                stack = tuple(stack)
+                thread = names.get(ident, str(ident))
+                counts[thread][stack] += 1
+                weights[thread][stack] += weight or interval
+            del frames
+            samples += 1
+            if now >= deadline:
+                break
+            time.sleep(min(interval, max(deadline - time.perf_counter(), 0)))
+        return {
+            "duration": time.perf_counter() - started,
+            "interval": interval,
+            "samples": samples,
+            "threads": {
+                thread: [(stack, count, weights[thread][stack]) for stack, count in stack_counts.items()]
+                for thread, stack_counts in counts.items()
+            },
+        }
+
+
+def to_speedscope(result: dict, name: str = "blitz_x402") -> dict:
+    """转为 speedscope 文件格式（每个线程一个 sampled profile，相同的栈合并为一个带累计权重的样本）"""
+    frame_index = {}
+    frames = []
+    profiles = []
+    for thread, samples in sorted(result["threads"].items()):
+        stacks, weights = [], []
+        for stack, _, weight in samples:
+            indexes = []
+            for key in stack:
+                index = frame_index.get(key)
+                if index is None:
+                    index = frame_index[key] = len(frames)
+                    frames.append({"name": key[0], "file": _short_path(key[1]), "line": key[2]})
+                indexes.append(index)
+            stacks.append(indexes)
+            weights.append(round(weight, 6))
+        profiles.append({
+            "type": "sampled",
+            "name": thread,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 6),
+            "samples": stacks,
+            "weights": weights,
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "blitz_x402",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
+
+
+def to_collapsed(result: dict) -> str:
+    """转为 collapsed 文本："线程;根函数;...;叶函数 采样数"，供 flamegraph.pl 使用"""
+    counts = collections.Counter()
+    for thread, samples in result["threads"].items():
+        for stack, count, _ in samples:
+            names = ";".join(f"{key[0]} ({_short_path(key[1])}:{key[2]})" for key in stack)
+            counts[f"{thread};{names}" if names else thread] += count
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+def _format_stack(frames) -> list:
+    """帧列表（根在前）-> ["文件:行号 函数", ...]"""
+    return [
+        f"{_short_path(f.filename)}:{f.lineno} {f.name}"
+        for f in traceback.StackSummary.extract(((frame, frame.f_lineno) for frame in frames), lookup_lines=False)
+    ]
+
+
+def _thread_stack(frame) -> list:
+    """从线程当前帧向上回溯，返回根在前的帧列表"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_chain(coro, limit: int = 100) -> list:
+    """挂起协程沿 await 链向下的帧（根在前）；Task.get_stack() 只返回最外层协程的帧"""
+    frames = []
+    while coro is not None and len(frames) < limit:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+class _InFlight:
+    __slots__ = ("method", "path", "request_id", "started", "first_byte", "status", "task", "thread", "timings", "stacks")
+
+    def __init__(self, method: str, path: str, request_id: Optional[str], task, thread: int, timings: dict):
+        self.method = method
+        self.path = path
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.first_byte: Optional[float] = None
+        self.status: Optional[int] = None
+        self.task = task
+        self.thread = thread
+        self.timings = timings
+        self.stacks: list = []
+
+
+class SlowRequestRecorder:
+    """记录首字节耗时超过阈值的请求（有界环形缓冲区）"""
+
+    def __init__(
+        self,
+        threshold: float = 5.0,
+        capacity: int = 50,
+        snapshot_interval: float = 0.5,
+        max_snapshots: int = 5,
+    ):
+        """
+        Args:
+            threshold: 首字节耗时阈值（秒），<= 0 表示关闭
+            capacity: 保留的慢请求条数，超出时丢弃最旧的
+            snapshot_interval: 后台线程检查进行中请求的间隔（秒）
+            max_snapshots: 每个请求最多保留的调用栈快照数
+        """
+        self.threshold = threshold
+        self.snapshot_interval = snapshot_interval
+        self.max_snapshots = max_snapshots
+        self._records: collections.deque = collections.deque(maxlen=max(capacity, 1))
+        self._in_flight: dict = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def begin(self, method: str, path: str) -> _InFlight:
+        """请求开始（在事件循环中调用）"""
+        entry = _InFlight(method, path, request_id_var.get(), asyncio.current_task(), threading.get_ident(), {})
+        self._in_flight[id(entry)] = entry
+        return entry
+
+    def finish(self, entry: _InFlight) -> None:
+        """请求结束：首字节耗时超过阈值时写入环形缓冲区"""
+        self._in_flight.pop(id(entry), None)
+        now = time.perf_counter()
+        ttfb = (entry.first_byte or now) - entry.started
+        if ttfb < self.threshold:
+            return
+        metrics.SLOW_REQUESTS.inc()
+        self._records.append({
+            "method": entry.method,
+            "path": entry.path,
+            "request_id": entry.request_id,
+            "status": entry.status,
+            "finished_at": time.time(),
+            "ttfb_ms": round(ttfb * 1000, 1),
+            "duration_ms": round((now - entry.started) * 1000, 1),
+            "phases": {
+                name: {"count": count, "ms": round(total * 1000, 1)}
+                for name, (count, total) in sorted(entry.timings.items(), key=lambda item: -item[1][1])
+            },
+            "stacks": entry.stacks,
+        })
+        logger.warning(
+            "Slow request %s %s",
+            entry.method,
+            entry.path,
+            extra={"event": "slow_request", "ttfb_ms": round(ttfb * 1000, 1), "status": entry.status},
+        )
+
+    def records(self) -> list:
+        """最近的慢请求，最新的在前"""
+        return list(reversed(self._records))
+
+    def snapshot_once(self) -> None:
+        """为首字节耗时已超过阈值一半、尚未发出响应头的请求记录一次调用栈"""
+        now = time.perf_counter()
+        frames = None
+        for entry in list(self._in_flight.values()):
+            if entry.first_byte is not None or len(entry.stacks) >= self.max_snapshots:
+                continue
+            if now - entry.started < self.threshold / 2:
+                continue
+            if frames is None:
+                frames = sys._current_frames()
+            loop_frame = frames.get(entry.thread)
+            snapshot = {"at_ms": round((now - entry.started) * 1000, 1)}
+            try:
+                # 协程挂起的位置（在等什么）；事件循环被阻塞时看 loop 栈
+                snapshot["task"] = _format_stack(_await_chain(entry.task.get_coro())) if entry.task else []
+            except Exception as e:
+                snapshot["task"] = [f"<unavailable: {e}>"]
+            snapshot["loop"] = _format_stack(_thread_stack(loop_frame))
+            entry.stacks.append(snapshot)
+        del frames
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="slow-request-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self) -> None:
+        # 在独立线程中运行：事件循环被同步调用阻塞时仍能拿到快照
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.snapshot_once()
+            except Exception as e:
+                logger.warning("Slow request snapshot failed: %s", e)
+
+
+class SlowRequestMiddleware:
+    """ASGI 中间件：为每个 HTTP 请求登记开始/首字节/结束时间，阈值 <= 0 时直接透传"""
+
+    def __init__(self, app, recorder: SlowRequestRecorder, exclude_prefixes: tuple = ("/admin/",)):
+        """
+        Args:
+            recorder: 慢请求记录器
+            exclude_prefixes: 不记录的路径前缀（剖析接口本身就会持续数秒）
+        """
+        self.app = app
+        self.recorder = recorder
+        self.exclude_prefixes = exclude_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if not self.recorder.enabled or scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            return await self.app(scope, receive, send)
+
+        entry = self.recorder.begin(scope["method"], scope["path"])
+        # 请求内 tracing.span 的耗时累加到 entry.timings
+        token = tracing.phase_timings.set(entry.timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                entry.first_byte = time.perf_counter()
+                entry.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            tracing.phase_timings.reset(token)
+            self.recorder.finish(entry)
+
+
+def profile_response_body(result: dict, fmt: str) -> tuple[bytes, str]:
+    """把采样结果编码为响应体，返回 (内容, media_type)"""
+    if fmt == "collapsed":
+        return to_collapsed(result).encode(), "text/plain; charset=utf-8"
+    return json.dumps(to_speedscope(result), separators=(",", ":")).encode(), "application/json"
@@ -0,0 +1,188 @@
+"""
+自动插入 prompt caching 断点
+
+Agent 循环里同一用户的请求通常共享相同的 tools / system 和越来越长的消息前缀，
+但客户端很少自己标注 cache_control。开启后代理为每个用户记录最近几次请求的
+前缀指纹，发现稳定前缀时插入 {"type": "ephemeral"} 断点，让上游命中缓存读取。
+
+- tools → system → messages 是上游缓存前缀的顺序，所以 system（没有则最后一个 tool）
+  上的一个断点即可覆盖 tools + system
+- 消息前缀取与最近请求相同的最长前缀，在其最后一条消息上再加一个断点
+- 客户端已自带 cache_control 时不做任何改写
+- 前缀小于 min_prefix_bytes（约 1024 tokens）时不插入，上游不会缓存过短的前缀
+
+cache_report() 按是否插入断点分别统计缓存读取比例与折算后的上游输入成本。
+代理向用户计费时缓存写入 / 读取仍按普通输入 token 全额计算，报告中的上游成本不是用户被扣的金额。
+"""
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+import metrics
+from request_body import json_loads, json_dumps
+
+EPHEMERAL = {"type": "ephemeral"}
+
+# 上游价格系数（相对普通输入 token）：缓存写入 1.25x，缓存读取 0.1x
+CACHE_WRITE_COST = 1.25
+CACHE_READ_COST = 0.1
+
+# 不能附加 cache_control 的内容块类型
+_UNCACHEABLE_BLOCKS = {"thinking", "redacted_thinking"}
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()[:16]
+
+
+def _mark_content(message: dict) -> bool:
+    """在消息最后一个内容块上加断点，成功返回 True"""
+    content = message.get("content")
+    if isinstance(content, str):
+        message["content"] = [{"type": "text", "text": content, "cache_control": dict(EPHEMERAL)}]
+        return True
+    if isinstance(content, list) and content and isinstance(content[-1], dict):
+        if content[-1].get("type") in _UNCACHEABLE_BLOCKS:
+            return False
+        content[-1]["cache_control"] = dict(EPHEMERAL)
+        return True
+    return False
+
+
+class PromptCacheInjector:
+    """按用户跟踪前缀指纹并插入缓存断点"""
+
+    def __init__(self, max_users: int = 10000, history: int = 4, min_prefix_bytes: int = 4096):
+        self.max_users = max_users
+        self.history = history
+        self.min_prefix_bytes = min_prefix_bytes
+        self._users: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, user_key: str) -> list:
+        with self._lock:
+            entries = self._users.get(user_key)
+            if entries is None:
+                return []
+            self._users.move_to_end(user_key)
+            return list(entries)
+
+    def _remember(self, user_key: str, entry: tuple) -> None:
+        with self._lock:
+            entries = self._users.get(user_key)
+            if entries is None:
+                entries = self._users[user_key] = deque(maxlen=self.history)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            entries.append(entry)
+
+    def rewrite(self, user_key: str, body: bytes) -> tuple[bytes, int]:
+        """
+        按需插入缓存断点
+
+        Args:
+            user_key: 用户标识（钱包地址）
+            body: 请求体
+
+        Returns:
+            (请求体, 插入的断点数)；未插入时返回原始字节
+        """
+        if b'"cache_control"' in body:
+            return body, 0
+        data = json_loads(body)
+        if not isinstance(data, dict):
+            return body, 0
+
+        tools = data.get("tools")
+        system = data.get("system")
+        messages = data.get("messages")
+        if not isinstance(messages, list):
+            messages = []
+
+        static_bytes = (json_dumps(tools) if tools else b"") + b"\0" + (json_dumps(system) if system else b"")
+        static_fp = _digest(static_bytes)
+
+        # 逐条累积的消息前缀指纹与字节数
+        prefix_fps = []
+        prefix_sizes = []
+        hasher = hashlib.sha256(static_fp)
+        size = len(static_bytes)
+        for message in messages:
+            encoded = json_dumps(message)
+            hasher.update(encoded)
+            size += len(encoded)
+            prefix_fps.append(hasher.copy().digest()[:16])
+            prefix_sizes.append(size)
+
+        recent = self._recent(user_key)
+        self._remember(user_key, (static_fp, frozenset(prefix_fps)))
+
+        same_static = [fps for fp, fps in recent if fp == static_fp]
+        if not same_static:
+            return body, 0
+
+        injected = 0
+        # 1. tools + system 稳定：在 system（没有则最后一个 tool）上加断点
+        if len(static_bytes) >= self.min_prefix_bytes:
+            if isinstance(system, str) and system:
+                data["system"] = [{"type": "text", "text": system, "cache_control": dict(EPHEMERAL)}]
+                injected += 1
+            elif isinstance(system, list) and system and isinstance(system[-1], dict):
+                system[-1]["cache_control"] = dict(EPHEMERAL)
+                injected += 1
+            elif isinstance(tools, list) and tools and isinstance(tools[-1], dict):
+                tools[-1]["cache_control"] = dict(EPHEMERAL)
+                injected += 1
+
+        # 2. 与最近请求相同的最长消息前缀
+        common = 0
+        for fps in same_static:
+            k = len(prefix_fps)
+            while k > common and prefix_fps[k - 1] not in fps:
+                k -= 1
+            common = max(common, k)
+        if common and prefix_sizes[common - 1] >= self.min_prefix_bytes:
+            if _mark_content(messages[common - 1]):
+                injected += 1
+
+        if not injected:
+            return body, 0
+        metrics.CLAUDE_PROMPT_CACHE_BREAKPOINTS.inc(injected)
+        return json_dumps(data), injected
+
+
+def record_cache_usage(usage: dict, auto_cache: bool) -> None:
+    """按是否插入断点累计输入 token，用于对比缓存读取比例与成本"""
+    label = "true" if auto_cache else "false"
+    for kind in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+        value = usage.get(kind) or 0
+        if value:
+            metrics.CLAUDE_INPUT_TOKENS.inc(value, kind=kind, auto_cache=label)
+    metrics.CLAUDE_USAGE_REQUESTS.inc(auto_cache=label)
+
+
+def cache_report() -> dict:
+    """
+    缓存效果汇总
+
+    - billed_input_tokens：代理向用户计费的输入 token（缓存写入 / 读取与普通输入同价，即输入总量）
+    - upstream_cost_input_tokens：按上游价格折算的输入成本（缓存写入 1.25x、读取 0.1x）
+    - upstream_savings_ratio：上游成本相对全部按普通 token 计价时节省的比例，
+      节省归代理所有，用户的计费不变
+    """
+    report = {}
+    for label in ("true", "false"):
+        plain = metrics.CLAUDE_INPUT_TOKENS.value(kind="input_tokens", auto_cache=label)
+        created = metrics.CLAUDE_INPUT_TOKENS.value(kind="cache_creation_input_tokens", auto_cache=label)
+        read = metrics.CLAUDE_INPUT_TOKENS.value(kind="cache_read_input_tokens", auto_cache=label)
+        total = plain + created + read
+        effective = plain + created * CACHE_WRITE_COST + read * CACHE_READ_COST
+        report["auto_cache" if label == "true" else "no_auto_cache"] = {
+            "requests": int(metrics.CLAUDE_USAGE_REQUESTS.value(auto_cache=label)),
+            "input_tokens_total": int(total),
+            "cache_read_ratio": round(read / total, 4) if total else 0.0,
+            "billed_input_tokens": int(total),
+            "upstream_cost_input_tokens": round(effective, 1),
+            "upstream_savings_ratio": round(1 - effective / total, 4) if total else 0.0,
+        }
+    return report
@@ -0,0 +1,244 @@
+"""
+tools / system 内容寻址存储
+
+Agent 客户端每次 /v1/messages 都会重复发送同样的数 KB tools 与 system。
+客户端可以先把内容上传一次（POST /v1/prompt-refs，返回 sha256 引用），
+之后在请求体里用 "tools_ref" / "system_ref" 代替原字段，代理在转发前展开，
+上游收到的请求与直接发送完整内容时完全相同。
+
+协议：
+- 引用格式为 "sha256:<hex>"，hex 是上传时请求体原始字节的 sha256，客户端可在本地计算
+- 引用未命中时 /v1/messages 返回 409 {"error": "unknown_ref", "missing_refs": [...]}，
+  客户端重新上传后重试，或直接发送完整字段
+
+引用按上传用户隔离：引用可由任何人根据内容算出，全局共享会让任意用户展开（或探测）别人上传的内容，
+因此只有上传过该内容的用户能展开它；不同用户上传相同内容时各存一份。
+
+内存与磁盘都有字节上限：内存按 LRU 淘汰；磁盘目录超过 disk_max_bytes 时按修改时间删除最旧的文件
+（命中时刷新修改时间，近似 LRU）。被淘汰的引用只会让客户端收到一次 409 后重新上传。
+"""
+import asyncio
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+from request_body import json_loads, json_dumps, JSON_DECODE_ERRORS
+
+# 请求体中可被引用替换的字段：引用字段名 -> 展开后的字段名
+REF_FIELDS = {"tools_ref": "tools", "system_ref": "system"}
+REF_PREFIX = "sha256:"
+_REF_PATTERN = re.compile(r"^sha256:[0-9a-f]{64}$")
+
+
+class UnknownRefs(Exception):
+    """请求中引用的内容不在存储中"""
+
+    def __init__(self, refs: list[str]):
+        super().__init__(f"Unknown prompt refs: {', '.join(refs)}")
+        self.refs = refs
+
+
+class PromptRefStore:
+    """LRU 内存缓存 + 可选磁盘目录的内容寻址存储（按上传用户隔离）"""
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        directory: str = "",
+        disk_max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._items: "OrderedDict[tuple[str, str], bytes]" = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_size = self._evict_files()
+
+    @staticmethod
+    def ref_for(content: bytes) -> str:
+        return REF_PREFIX + hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def _namespace(owner: str) -> str:
+        # 地址大小写不敏感；取哈希保证可以安全地用作文件名
+        return hashlib.sha256(owner.lower().encode()).hexdigest()[:32]
+
+    def _path(self, namespace: str, ref: str) -> str:
+        return os.path.join(self.directory, f"{namespace}-{ref[len(REF_PREFIX):]}.json")
+
+    def _remember(self, key: tuple[str, str], content: bytes) -> None:
+        if key in self._items:
+            self._items.move_to_end(key)
+            return
+        self._items[key] = content
+        self._size += len(content)
+        while self._size > self.max_bytes and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _evict_files(self) -> int:
+        """
+        扫描磁盘目录，超过 disk_max_bytes 时从最旧的文件开始删除
+
+        多个 worker 共用目录时各自只累计自己写入的字节数，这里按实际目录内容重新计算。
+
+        Returns:
+            删除后目录中的字节数
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.disk_max_bytes:
+            return total
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            metrics.CLAUDE_PROMPT_REF_DISK_EVICTIONS.inc()
+        return total
+
+    def _write_file(self, namespace: str, ref: str, content: bytes) -> None:
+        path = self._path(namespace, ref)
+        if os.path.exists(path):
+            return
+        # 单个内容超过磁盘上限时只保留在内存中
+        if len(content) > self.disk_max_bytes:
+            return
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+        self._disk_size += len(content)
+        if self._disk_size > self.disk_max_bytes:
+            self._disk_size = self._evict_files()
+
+    def _read_file(self, namespace: str, ref: str) -> Optional[bytes]:
+        path = self._path(namespace, ref)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        # 磁盘内容被篡改或损坏时视为未命中
+        if self.ref_for(content) != ref:
+            return None
+        # 刷新修改时间，淘汰时保留最近使用的文件
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    async def put(self, content: bytes, owner: str) -> str:
+        """
+        存储一段 JSON 内容并返回引用
+
+        Args:
+            content: 字段的 JSON 值
+            owner: 上传用户地址，只有该用户能展开返回的引用
+
+        Raises:
+            ValueError: 内容不是合法 JSON
+        """
+        try:
+            json_loads(content)
+        except JSON_DECODE_ERRORS as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        ref = self.ref_for(content)
+        namespace = self._namespace(owner)
+        self._remember((namespace, ref), content)
+        if self.directory:
+            await asyncio.to_thread(self._write_file, namespace, ref, content)
+        return ref
+
+    async def get(self, ref: str, owner: Optional[str]) -> Optional[bytes]:
+        """查找 owner 上传过的引用内容；匿名请求（owner 为空）总是未命中"""
+        if not owner:
+            metrics.CLAUDE_PROMPT_REF_LOOKUPS.inc(result="miss")
+            return None
+        namespace = self._namespace(owner)
+        key = (namespace, ref)
+        content = self._items.get(key)
+        if content is not None:
+            self._items.move_to_end(key)
+            metrics.CLAUDE_PROMPT_REF_LOOKUPS.inc(result="memory")
+            return content
+        # 只接受格式合法的引用，防止拼接磁盘路径时目录穿越
+        if self.directory and _REF_PATTERN.match(ref):
+            content = await asyncio.to_thread(self._read_file, namespace, ref)
+            if content is not None:
+                self._remember(key, content)
+                metrics.CLAUDE_PROMPT_REF_LOOKUPS.inc(result="disk")
+                return content
+        metrics.CLAUDE_PROMPT_REF_LOOKUPS.inc(result="miss")
+        return None
+
+
+def has_refs(body: bytes) -> bool:
+    """快速判断请求体是否可能包含引用字段（避免对普通请求做完整解析）"""
+    return b'_ref"' in body
+
+
+async def expand_refs(body: bytes, store: PromptRefStore, owner: Optional[str]) -> bytes:
+    """
+    展开请求体中的 tools_ref / system_ref
+
+    只重新序列化请求体的其余部分，存储的内容按原始字节拼接，不再解析。
+    只能展开 owner 自己上传过的引用。
+
+    Raises:
+        UnknownRefs: 有引用未命中
+        ValueError: 请求体不是 JSON 对象或引用格式错误
+    """
+    data = json_loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    refs = {field: data.pop(field) for field in REF_FIELDS if field in data}
+    if not refs:
+        return body
+
+    expanded = []
+    missing = []
+    for field, ref in refs.items():
+        target = REF_FIELDS[field]
+        if not isinstance(ref, str):
+            raise ValueError(f"Field '{field}' must be a string")
+        if target in data:
+            raise ValueError(f"Fields '{field}' and '{target}' are mutually exclusive")
+        content = await store.get(ref, owner)
+        if content is None:
+            missing.append(ref)
+        else:
+            expanded.append((target, content))
+    if missing:
+        raise UnknownRefs(missing)
+
+    parts = [json_dumps(data)[:-1]]
+    for target, content in expanded:
+        if len(parts[-1]) > 1 or len(parts) > 1:
+            parts.append(b",")
+        parts.append(b'"' + target.encode() + b'":')
+        parts.append(content)
+        metrics.CLAUDE_PROMPT_REF_BYTES_EXPANDED.inc(len(content))
+    parts.append(b"}")
+    return b"".join(parts)
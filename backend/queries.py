@@ -0,0 +1,266 @@
+"""
+热路径 SQL 语句
+
+每次调用都写 text("...") 会重复解析绑定参数、生成缓存键；这里在导入时构造一次，
+执行时直接命中 SQLAlchemy 的编译缓存（engine 级 compiled cache），只剩参数绑定。
+
+pymysql 不支持服务端预编译语句（COM_STMT_PREPARE），参数在客户端转义后以文本协议发送，
+所以这里的优化只覆盖 Python 侧的构造与编译开销。
+基准：python benchmarks/bench_sql_statements.py
+
+方言相关的语句（upsert、INSERT IGNORE、FOR UPDATE、时间函数）用 DialectText 同时给出
+MySQL 与 SQLite 两种写法，编译时按连接的方言选择；调用方不需要区分存储后端（见 storage.py）。
+
+金额（wei）在 MySQL 中是 DECIMAL(36, 0)；SQLite 的整数只有 64 位，金额列存十进制文本，
+SQLite 写法中金额参数以字符串绑定，加减、比较与求和用 storage.py 注册的 wei_add / wei_sub /
+wei_cmp / wei_sum 函数（Python 整数运算），SQLite 自身不对金额列做算术。
+"""
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.types import String, TypeDecorator
+
+
+class Wei(TypeDecorator):
+    """SQLite 金额参数：绑定为十进制字符串（Python int 超过 64 位时 sqlite3 无法绑定）"""
+
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else str(int(value))
+
+
+class DialectText(Executable, ClauseElement):
+    """
+    按方言选择文本的语句：sqlite 方言使用 sqlite 文本，其他方言使用 mysql 文本
+
+    amounts 中的参数名在 sqlite 文本中按 Wei 绑定。
+    """
+
+    inherit_cache = True
+    # 两种文本都参与缓存键，编译缓存按 engine（即方言）区分，缓存命中与 text() 相同
+    _traverse_internals = [
+        ("mysql", InternalTraversal.dp_clauseelement),
+        ("sqlite", InternalTraversal.dp_clauseelement),
+    ]
+
+    def __init__(self, mysql: str, sqlite: str, amounts: tuple = ()):
+        self.mysql = text(mysql)
+        self.sqlite = text(sqlite)
+        if amounts:
+            self.sqlite = self.sqlite.bindparams(*(bindparam(name, type_=Wei()) for name in amounts))
+
+
+@compiles(DialectText)
+def _compile_dialect_text(element, compiler, **kw):
+    chosen = element.sqlite if compiler.dialect.name == "sqlite" else element.mysql
+    return compiler.process(chosen, **kw)
+
+# 查询余额
+SELECT_BALANCE = text("SELECT balance FROM user_balances WHERE user_address = :u")
+
+# 条件扣费：余额不足时不更新（rowcount == 0）
+DEBIT_BALANCE = DialectText(
+    "UPDATE user_balances "
+    "SET balance = balance - :amount "
+    "WHERE user_address = :u AND balance >= :amount",
+    "UPDATE user_balances "
+    "SET balance = wei_sub(balance, :amount) "
+    "WHERE user_address = :u AND wei_cmp(balance, :amount) >= 0",
+    amounts=("amount",),
+)
+
+# 增加余额（用户不存在时创建）
+CREDIT_BALANCE = DialectText(
+    "INSERT INTO user_balances (user_address, balance) "
+    "VALUES (:u, :a) "
+    "ON DUPLICATE KEY UPDATE balance = balance + VALUES(balance)",
+    "INSERT INTO user_balances (user_address, balance) "
+    "VALUES (:u, :a) "
+    "ON CONFLICT (user_address) DO UPDATE SET balance = wei_add(balance, excluded.balance)",
+    amounts=("a",),
+)
+
+# 写入充值记录，tx_hash 唯一键去重（重复时 rowcount == 0）
+# status 为 success，或开启确认深度时为 pending（已临时入账，等待确认）
+# MySQL 的 INSERT IGNORE 会把超长 / 超范围的值截断后写入，调用方须先校验（见 main.credit_recharge）；
+# SQLite 只忽略 tx_hash 冲突，其他约束（如 amount CHECK）照常报错
+INSERT_RECHARGE_RECORD = DialectText(
+    "INSERT IGNORE INTO recharge_records "
+    "(user_address, amount, tx_hash, client_type, status, block_number, block_hash) "
+    "VALUES (:u, :a, :h, :c, :s, :bn, :bh)",
+    "INSERT INTO recharge_records "
+    "(user_address, amount, tx_hash, client_type, status, block_number, block_hash) "
+    "VALUES (:u, :a, :h, :c, :s, :bn, :bh) "
+    "ON CONFLICT (tx_hash) DO NOTHING",
+    amounts=("a",),
+)
+
+# 连通性检查
+PING = text("SELECT 1")
+
+# ========== 余额事件账本 ==========
+
+INSERT_BALANCE_EVENT = DialectText(
+    "INSERT INTO balance_events (user_address, kind, amount, ref) VALUES (:u, :k, :a, :r)",
+    "INSERT INTO balance_events (user_address, kind, amount, ref) VALUES (:u, :k, :a, :r)",
+    amounts=("a",),
+)
+
+SELECT_LATEST_SNAPSHOT = text(
+    "SELECT balance, last_event_id FROM balance_snapshots "
+    "WHERE user_address = :u ORDER BY last_event_id DESC LIMIT 1"
+)
+
+# 快照之后的余额变化（走 idx_user_id 范围扫描；settle 不计入余额）
+SUM_EVENTS_AFTER = DialectText(
+    "SELECT COALESCE(SUM(CASE WHEN kind <> 'settle' THEN amount ELSE 0 END), 0), COUNT(*) "
+    "FROM balance_events WHERE user_address = :u AND id > :after",
+    "SELECT COALESCE(wei_sum(CASE WHEN kind <> 'settle' THEN amount ELSE '0' END), '0'), COUNT(*) "
+    "FROM balance_events WHERE user_address = :u AND id > :after",
+)
+
+# 生成快照：只汇总 (after, upto] 区间，upto 取上一轮看到的最大 ID，避免漏掉晚提交的小 ID 事件
+SUM_EVENTS_BETWEEN = DialectText(
+    "SELECT COALESCE(SUM(CASE WHEN kind <> 'settle' THEN amount ELSE 0 END), 0) "
+    "FROM balance_events WHERE user_address = :u AND id > :after AND id <= :upto",
+    "SELECT COALESCE(wei_sum(CASE WHEN kind <> 'settle' THEN amount ELSE '0' END), '0') "
+    "FROM balance_events WHERE user_address = :u AND id > :after AND id <= :upto",
+)
+
+SELECT_USERS_WITH_EVENTS_BETWEEN = text(
+    "SELECT DISTINCT user_address FROM balance_events WHERE id > :after AND id <= :upto"
+)
+
+SELECT_MAX_EVENT_ID = text("SELECT COALESCE(MAX(id), 0) FROM balance_events")
+
+SELECT_SNAPSHOT_WATERMARK = text("SELECT COALESCE(MAX(last_event_id), 0) FROM balance_snapshots")
+
+# 快照水位（仅 MySQL）：等待写过 balance_events 的事务全部提交后再读取 MAX(id)
+SET_LOCK_WAIT_TIMEOUT = text("SET SESSION lock_wait_timeout = :t")
+RESET_LOCK_WAIT_TIMEOUT = text("SET SESSION lock_wait_timeout = DEFAULT")
+LOCK_EVENTS_READ = text("LOCK TABLES balance_events READ")
+UNLOCK_TABLES = text("UNLOCK TABLES")
+
+INSERT_SNAPSHOT = DialectText(
+    "INSERT IGNORE INTO balance_snapshots (user_address, last_event_id, balance) "
+    "VALUES (:u, :id, :b)",
+    "INSERT OR IGNORE INTO balance_snapshots (user_address, last_event_id, balance) "
+    "VALUES (:u, :id, :b)",
+    amounts=("b",),
+)
+
+# ========== 热点账户余额分片 ==========
+
+# 余额 = 主行 + 分片之和（开启分片时替代 SELECT_BALANCE）
+SELECT_TOTAL_BALANCE = DialectText(
+    "SELECT b.balance + COALESCE("
+    "(SELECT SUM(s.balance) FROM user_balance_shards s WHERE s.user_address = b.user_address), 0) "
+    "FROM user_balances b WHERE b.user_address = :u",
+    "SELECT wei_add(b.balance, "
+    "(SELECT wei_sum(s.balance) FROM user_balance_shards s WHERE s.user_address = b.user_address)) "
+    "FROM user_balances b WHERE b.user_address = :u",
+)
+
+# 单个分片条件扣费（rowcount == 0 表示该分片余额不足）
+DEBIT_SHARD = DialectText(
+    "UPDATE user_balance_shards "
+    "SET balance = balance - :amount "
+    "WHERE user_address = :u AND shard = :s AND balance >= :amount",
+    "UPDATE user_balance_shards "
+    "SET balance = wei_sub(balance, :amount) "
+    "WHERE user_address = :u AND shard = :s AND wei_cmp(balance, :amount) >= 0",
+    amounts=("amount",),
+)
+
+ENSURE_SHARD = DialectText(
+    "INSERT IGNORE INTO user_balance_shards (user_address, shard, balance) VALUES (:u, :s, 0)",
+    "INSERT OR IGNORE INTO user_balance_shards (user_address, shard, balance) VALUES (:u, :s, '0')",
+)
+
+# 重新分配前锁住主行与全部分片（固定顺序：主行 → 分片按主键）
+# SQLite 没有行锁：用一条不改值的 UPDATE 开始写事务并取得库级写锁，之后的读取都在该事务内
+LOCK_MAIN_BALANCE = DialectText(
+    "SELECT balance FROM user_balances WHERE user_address = :u FOR UPDATE",
+    "UPDATE user_balances SET balance = balance WHERE user_address = :u RETURNING balance",
+)
+
+LOCK_SHARDS = DialectText(
+    "SELECT shard, balance FROM user_balance_shards WHERE user_address = :u ORDER BY shard FOR UPDATE",
+    "SELECT shard, balance FROM user_balance_shards WHERE user_address = :u ORDER BY shard",
+)
+
+SET_MAIN_BALANCE = DialectText(
+    "UPDATE user_balances SET balance = :b WHERE user_address = :u",
+    "UPDATE user_balances SET balance = :b WHERE user_address = :u",
+    amounts=("b",),
+)
+
+SET_SHARD_BALANCE = DialectText(
+    "UPDATE user_balance_shards SET balance = :b WHERE user_address = :u AND shard = :s",
+    "UPDATE user_balance_shards SET balance = :b WHERE user_address = :u AND shard = :s",
+    amounts=("b",),
+)
+
+SELECT_USERS_WITH_SHARD_FUNDS = DialectText(
+    "SELECT DISTINCT user_address FROM user_balance_shards WHERE balance <> 0",
+    "SELECT DISTINCT user_address FROM user_balance_shards WHERE balance <> '0'",
+)
+
+# ========== 链上对账 ==========
+
+# 按 tx_hash 排序流式读取时间窗口内已入账（含等待确认）的充值记录（与链上转账做归并比较）
+SELECT_RECHARGES_FOR_RECONCILE = DialectText(
+    "SELECT LOWER(tx_hash), user_address, amount, UNIX_TIMESTAMP(created_at) FROM recharge_records "
+    "WHERE status IN ('success', 'pending') AND created_at >= FROM_UNIXTIME(:start) AND created_at < FROM_UNIXTIME(:end) "
+    "ORDER BY LOWER(tx_hash)",
+    "SELECT LOWER(tx_hash), user_address, amount, CAST(strftime('%s', created_at) AS INTEGER) FROM recharge_records "
+    "WHERE status IN ('success', 'pending') "
+    "AND created_at >= datetime(:start, 'unixepoch') AND created_at < datetime(:end, 'unixepoch') "
+    "ORDER BY LOWER(tx_hash)",
+)
+
+# ========== 充值确认与 reorg 处理 ==========
+
+SELECT_PENDING_RECHARGES = text(
+    "SELECT id, tx_hash, user_address, amount, block_number, block_hash FROM recharge_records "
+    "WHERE status = 'pending' ORDER BY id LIMIT :limit"
+)
+
+# 交易仍在原区块：更新确认数；被重新打包进其他区块：更新区块并重新计数
+UPDATE_RECHARGE_BLOCK = text(
+    "UPDATE recharge_records SET block_number = :bn, block_hash = :bh, confirmations = :n "
+    "WHERE id = :id AND status = 'pending'"
+)
+
+CONFIRM_RECHARGE = text(
+    "UPDATE recharge_records SET status = 'success', block_number = :bn, block_hash = :bh, confirmations = :n "
+    "WHERE id = :id AND status = 'pending'"
+)
+
+# 状态条件保证只撤销一次（rowcount == 1 时才扣回余额）
+REVERSE_RECHARGE = text(
+    "UPDATE recharge_records SET status = 'reversed' WHERE id = :id AND status = 'pending'"
+)
+
+# 已撤销的交易被重新打包后再次提交：记录恢复为 pending / success 并重新入账
+# 状态条件保证并发重复提交只有一个 rowcount == 1
+REINSTATE_RECHARGE = DialectText(
+    "UPDATE recharge_records SET amount = :a, client_type = :c, status = :s, "
+    "block_number = :bn, block_hash = :bh, confirmations = 0 "
+    "WHERE tx_hash = :h AND user_address = :u AND status = 'reversed'",
+    "UPDATE recharge_records SET amount = :a, client_type = :c, status = :s, "
+    "block_number = :bn, block_hash = :bh, confirmations = 0 "
+    "WHERE tx_hash = :h AND user_address = :u AND status = 'reversed'",
+    amounts=("a",),
+)
+
+# 撤销入账：无条件扣回（余额已被使用时允许为负）
+REVERSE_BALANCE = DialectText(
+    "UPDATE user_balances SET balance = balance - :a WHERE user_address = :u",
+    "UPDATE user_balances SET balance = wei_sub(balance, :a) WHERE user_address = :u",
+    amounts=("a",),
+)
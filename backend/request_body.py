@@ -0,0 +1,112 @@
+"""
+/v1/messages 请求体快速解析
+
+代理只需要 model / max_tokens / stream 三个字段来计费和选择转发方式，
+其余内容（messages、tools、system 等）原样以字节转发上游，
+避免 Pydantic 校验 + model_dump + 再次 JSON 编码带来的多份完整拷贝。
+
+扣费发生在转发之前，上游必然拒绝的请求（缺少 messages、缺少 max_tokens 或 max_tokens <= 0）
+在这里就返回 400，避免预扣的余额随上游错误一起丢失：messages 必须是非空数组，每条消息是带 role
+与 content 的对象（content 不展开，只确认字段存在）；max_tokens 是上游必填字段，请求体原样转发，
+这里不补默认值。
+
+解析器按可用性依次选择：msgspec（只物化三个字段）> orjson > 标准库 json。
+"""
+import json
+from typing import Annotated, NamedTuple, Optional
+
+class MessageHead(NamedTuple):
+    """请求体中代理关心的字段"""
+    model: str
+    max_tokens: int
+    stream: bool
+
+
+class InvalidRequestBody(ValueError):
+    """请求体不是合法的 Claude messages 请求"""
+
+
+# 需要完整解析 / 改写请求体时（prompt 引用展开等）使用的 JSON 编解码
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+    JSON_DECODE_ERRORS = (orjson.JSONDecodeError,)
+except ImportError:
+    json_loads = json.loads
+    JSON_DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+try:
+    import msgspec
+
+    class _MessageStruct(msgspec.Struct):
+        role: str
+        content: msgspec.Raw
+
+    class _MessageHeadStruct(msgspec.Struct):
+        model: str
+        messages: Annotated[list[_MessageStruct], msgspec.Meta(min_length=1)]
+        max_tokens: Annotated[int, msgspec.Meta(gt=0)]
+        stream: Optional[bool] = False
+
+    _decoder = msgspec.json.Decoder(_MessageHeadStruct)
+
+    def _decode_head(body: bytes) -> tuple:
+        try:
+            head = _decoder.decode(body)
+        except msgspec.DecodeError as e:
+            raise InvalidRequestBody(str(e))
+        return head.model, head.max_tokens, head.stream
+
+    PARSER = "msgspec"
+except ImportError:
+    PARSER = "orjson" if json_loads is not json.loads else "json"
+
+    def _decode_head(body: bytes) -> tuple:
+        try:
+            data = json_loads(body)
+        except JSON_DECODE_ERRORS as e:
+            raise InvalidRequestBody(str(e))
+        if not isinstance(data, dict):
+            raise InvalidRequestBody("Request body must be a JSON object")
+        model = data.get("model")
+        if not isinstance(model, str):
+            raise InvalidRequestBody("Field 'model' is required and must be a string")
+        messages = data.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise InvalidRequestBody("Field 'messages' is required and must be a non-empty array")
+        for message in messages:
+            if not isinstance(message, dict) or not isinstance(message.get("role"), str) or "content" not in message:
+                raise InvalidRequestBody("Each message must be an object with 'role' and 'content'")
+        max_tokens = data.get("max_tokens")
+        if max_tokens is None:
+            raise InvalidRequestBody("Field 'max_tokens' is required")
+        if isinstance(max_tokens, bool) or not isinstance(max_tokens, int):
+            raise InvalidRequestBody("Field 'max_tokens' must be an integer")
+        if max_tokens <= 0:
+            raise InvalidRequestBody("Field 'max_tokens' must be greater than 0")
+        stream = data.get("stream", False)
+        if stream is not None and not isinstance(stream, bool):
+            raise InvalidRequestBody("Field 'stream' must be a boolean")
+        return model, max_tokens, stream
+
+
+def parse_message_head(body: bytes) -> MessageHead:
+    """
+    从原始请求体中解析 model / max_tokens / stream
+
+    Args:
+        body: 原始请求体字节
+
+    Returns:
+        MessageHead
+
+    Raises:
+        InvalidRequestBody: JSON 非法、字段类型不符、messages 为空、缺少 max_tokens 或 max_tokens <= 0
+    """
+    model, max_tokens, stream = _decode_head(body)
+    return MessageHead(model=model, max_tokens=max_tokens, stream=bool(stream))
@@ -0,0 +1,204 @@
+"""
+多 RPC 节点连接池（web3 Provider）
+
+main.py、x402_facilitator.py 与各脚本共用：
+1. 每个节点一个 keep-alive 的 requests.Session（连接池），按方法配置请求超时
+2. 记录每个节点的延迟（EWMA）与错误率，读请求发给最快的健康节点；
+   连接错误 / 超时 / HTTP 429、5xx / 限流类 JSON-RPC 错误时切换到下一个节点，失败节点短暂冷却
+3. 少量请求随机发给其他健康节点，保持各节点的延迟数据是新的
+4. eth_sendRawTransaction 同时发给多个节点，返回最先成功的结果（同一笔签名交易，哈希相同）
+
+普通的 JSON-RPC 错误（如 execution reverted、交易不存在）是节点的正常应答，不切换节点。
+"""
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+import metrics
+import tracing
+
+# 同时发给多个节点的写请求
+FANOUT_METHODS = {"eth_sendRawTransaction"}
+
+# 节点因限流拒绝请求时常见的 JSON-RPC 错误码
+RATE_LIMIT_CODES = {-32005, -32029, 429}
+
+
+class EndpointFailure(Exception):
+    """节点本身不可用（而不是请求有误），应切换节点"""
+
+
+class RpcEndpoint:
+    """单个 RPC 节点：连接池 + 延迟 / 错误率统计"""
+
+    def __init__(self, url: str, pool_size: int, failure_cooldown: float, alpha: float = 0.2):
+        self.url = url
+        self.label = urlparse(url).netloc or url  # 指标标签只用主机名（路径里可能带 API key）
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.failure_cooldown = failure_cooldown
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self) -> float:
+        """越小越好：延迟 EWMA，按错误率放大；没有数据的节点优先试一次"""
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 4 * self.error_rate)
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            if ok:
+                self.latency = latency if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * latency
+            else:
+                self.cooldown_until = time.monotonic() + self.failure_cooldown
+            self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha * (0.0 if ok else 1.0)
+
+
+class MultiRPCProvider(JSONBaseProvider):
+    """多节点 JSON-RPC Provider：读请求按延迟路由并故障转移，发送交易并发广播"""
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        timeout: float = 10.0,
+        method_timeouts: Optional[dict] = None,
+        send_fanout: int = 3,
+        failure_cooldown: float = 10.0,
+        explore_ratio: float = 0.05,
+        pool_size: int = 20,
+    ):
+        super().__init__()
+        unique = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+        if not unique:
+            raise ValueError("At least one RPC URL is required")
+        self.endpoints = [RpcEndpoint(u, pool_size, failure_cooldown) for u in unique]
+        self.timeout = timeout
+        self.method_timeouts = method_timeouts or {}
+        self.send_fanout = max(1, send_fanout)
+        self.explore_ratio = explore_ratio
+        self._executor = ThreadPoolExecutor(max_workers=len(self.endpoints), thread_name_prefix="rpc-fanout")
+        for endpoint in self.endpoints:
+            metrics.RPC_ENDPOINT_LATENCY.set_function(
+                lambda e=endpoint: e.latency or 0.0, endpoint=endpoint.label
+            )
+            metrics.RPC_ENDPOINT_HEALTHY.set_function(
+                lambda e=endpoint: 1.0 if e.healthy(time.monotonic()) else 0.0, endpoint=endpoint.label
+            )
+
+    def __str__(self) -> str:
+        return f"MultiRPCProvider({', '.join(e.label for e in self.endpoints)})"
+
+    def _ranked(self) -> list[RpcEndpoint]:
+        """健康节点按得分排序在前，冷却中的节点作为最后手段"""
+        now = time.monotonic()
+        healthy = sorted((e for e in self.endpoints if e.healthy(now)), key=RpcEndpoint.score)
+        cooling = sorted((e for e in self.endpoints if not e.healthy(now)), key=lambda e: e.cooldown_until)
+        if len(healthy) > 1 and random.random() < self.explore_ratio:
+            i = random.randrange(1, len(healthy))
+            healthy[0], healthy[i] = healthy[i], healthy[0]
+        return healthy + cooling
+
+    def _post(self, endpoint: RpcEndpoint, method: str, request_data: bytes):
+        started = time.perf_counter()
+        try:
+            response = endpoint.session.post(
+                endpoint.url,
+                data=request_data,
+                headers={"Content-Type": "application/json"},
+                timeout=self.method_timeouts.get(method, self.timeout),
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                raise EndpointFailure(f"HTTP {response.status_code} from {endpoint.label}")
+            response.raise_for_status()
+            decoded = self.decode_rpc_response(response.content)
+            error = decoded.get("error") if isinstance(decoded, dict) else None
+            if isinstance(error, dict) and (
+                error.get("code") in RATE_LIMIT_CODES or "rate limit" in str(error.get("message", "")).lower()
+            ):
+                raise EndpointFailure(f"Rate limited by {endpoint.label}: {error.get('message')}")
+        except (requests.RequestException, ValueError, EndpointFailure) as e:
+            elapsed = time.perf_counter() - started
+            endpoint.record(False, elapsed)
+            metrics.RPC_REQUESTS.inc(endpoint=endpoint.label, result="failure")
+            metrics.RPC_LATENCY.observe(elapsed, endpoint=endpoint.label, method=method)
+            if isinstance(e, EndpointFailure):
+                raise
+            raise EndpointFailure(f"{endpoint.label}: {e}") from e
+        elapsed = time.perf_counter() - started
+        endpoint.record(True, elapsed)
+        metrics.RPC_REQUESTS.inc(endpoint=endpoint.label, result="ok")
+        metrics.RPC_LATENCY.observe(elapsed, endpoint=endpoint.label, method=method)
+        return decoded
+
+    def _route(self, method: str, request_data: bytes):
+        last_error = None
+        for i, endpoint in enumerate(self._ranked()):
+            if i:
+                metrics.RPC_FAILOVERS.inc()
+            try:
+                return self._post(endpoint, method, request_data)
+            except EndpointFailure as e:
+                last_error = e
+        raise ConnectionError(f"All RPC endpoints failed for {method}: {last_error}")
+
+    def _fanout(self, method: str, request_data: bytes):
+        """并发发给多个节点，第一个成功应答立即返回；都返回错误时返回第一个错误应答"""
+        targets = self._ranked()[: self.send_fanout]
+        pending = {self._executor.submit(self._post, e, method, request_data) for e in targets}
+        first_error_response = None
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except EndpointFailure as e:
+                    last_error = e
+                    continue
+                if "error" not in response:
+                    # 其余请求在后台完成（"already known" 之类的应答直接丢弃）
+                    return response
+                if first_error_response is None:
+                    first_error_response = response
+        if first_error_response is not None:
+            return first_error_response
+        raise ConnectionError(f"All RPC endpoints failed for {method}: {last_error}")
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        with tracing.span("rpc." + method):
+            if method in FANOUT_METHODS and len(self.endpoints) > 1:
+                return self._fanout(method, request_data)
+            return self._route(method, request_data)
+
+
+def parse_method_timeouts(value: str) -> dict:
+    """解析 "eth_getLogs=30,eth_call=5" 形式的按方法超时配置"""
+    timeouts = {}
+    for item in value.split(","):
+        if "=" in item:
+            method, seconds = item.split("=", 1)
+            timeouts[method.strip()] = float(seconds)
+    return timeouts
+
+
+def make_web3(primary_url: str, extra_urls: Iterable[str] = (), **options) -> Web3:
+    """创建使用多节点 Provider 的 Web3（primary_url 在前，extra_urls 为备用节点）"""
+    return Web3(MultiRPCProvider([primary_url, *extra_urls], **options))
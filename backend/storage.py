@@ -0,0 +1,161 @@
+"""
+存储后端：MySQL 与 SQLite
+
+余额、充值记录、余额账本等读写语句都在 queries.py 中，方言相关的语句同时给出两种写法
+（如 MySQL 的 ON DUPLICATE KEY UPDATE / INSERT IGNORE 对应 SQLite 的 ON CONFLICT DO UPDATE /
+INSERT OR IGNORE），执行时按 engine 的方言编译，业务代码不区分后端。
+这里只负责按 DSN 创建 engine 并完成各后端的连接设置：
+
+- mysql+pymysql://...：带连接池监控的 engine（db.create_db_engine），表结构由 migrate.py 维护
+- sqlite:///path/to/blitz.db：WAL 模式的单文件数据库，启动时自动建表（database/sqlite/schema.sql），
+  适合单节点部署与不依赖 MySQL 的压测
+- sqlite://：内存数据库，进程退出即丢失，只用于测试
+
+SQLite 同一时刻只允许一个写事务：扣费、入账都是单条条件 UPDATE / upsert，写锁只持有到提交，
+等待写锁的连接由 busy_timeout 排队，而不是立即报 database is locked。
+SQLite 的整数只有 64 位（2^63-1 wei 约 9.22 MON），金额列因此存十进制文本，
+加减、比较、求和由每个连接上注册的 wei_* 函数用 Python 整数完成，没有上限。
+"""
+import os
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine, make_url
+
+from db import create_db_engine
+
+SQLITE_SCHEMA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "database", "sqlite", "schema.sql"
+)
+
+
+def is_sqlite(dsn: str) -> bool:
+    return make_url(dsn).get_backend_name() == "sqlite"
+
+
+def _is_memory(dsn: str) -> bool:
+    database = make_url(dsn).database
+    return not database or database == ":memory:"
+
+
+def _wei(value) -> int:
+    return int(value) if value is not None else 0
+
+
+def _wei_add(a, b):
+    if a is None:
+        return None
+    return str(int(a) + _wei(b))
+
+
+def _wei_sub(a, b):
+    if a is None:
+        return None
+    return str(int(a) - _wei(b))
+
+
+def _wei_cmp(a, b):
+    if a is None or b is None:
+        return None
+    a, b = int(a), int(b)
+    return (a > b) - (a < b)
+
+
+class _WeiSum:
+    """金额求和聚合（没有行时 SQLite 返回 NULL，与 SUM 相同）"""
+
+    def __init__(self):
+        self.total = 0
+
+    def step(self, value):
+        if value is not None:
+            self.total += int(value)
+
+    def finalize(self):
+        return str(self.total)
+
+
+def _install_sqlite_functions(dbapi_connection) -> None:
+    """注册金额运算函数（金额列是十进制文本，见 queries.py）"""
+    dbapi_connection.create_function("wei_add", 2, _wei_add, deterministic=True)
+    dbapi_connection.create_function("wei_sub", 2, _wei_sub, deterministic=True)
+    dbapi_connection.create_function("wei_cmp", 2, _wei_cmp, deterministic=True)
+    dbapi_connection.create_aggregate("wei_sum", 1, _WeiSum)
+
+
+def _install_sqlite_pragmas(engine: Engine, busy_timeout: float) -> None:
+    """每个新连接设置 WAL、同步级别与写锁等待时间，并注册金额运算函数"""
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        _install_sqlite_functions(dbapi_connection)
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL：读不阻塞写、写不阻塞读；内存数据库不支持，保持 memory 日志模式
+            cursor.execute("PRAGMA journal_mode=WAL")
+            # WAL 下 NORMAL 只在检查点时 fsync，断电最多丢失最近提交的事务，不会损坏数据库
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        finally:
+            cursor.close()
+
+
+def init_sqlite_schema(engine: Engine, schema_path: str = SQLITE_SCHEMA) -> None:
+    """创建 SQLite 表结构（语句均为 IF NOT EXISTS，可重复执行）"""
+    from migrate import split_statements
+
+    with open(schema_path, encoding="utf-8") as f:
+        statements = split_statements(f.read())
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+        # 早期的表结构金额列是 64 位 INTEGER，CREATE TABLE IF NOT EXISTS 不会改动已有的表
+        columns = {row[1]: row[2] for row in conn.execute(text("PRAGMA table_info(user_balances)"))}
+        if columns.get("balance", "").upper() != "TEXT":
+            raise RuntimeError(
+                "SQLite database uses INTEGER amount columns (capped at 2^63-1 wei); "
+                "export the data and recreate it with database/sqlite/schema.sql"
+            )
+
+
+def create_storage_engine(
+    dsn: str,
+    pool_size: int = 10,
+    max_overflow: int = 10,
+    pool_recycle: int = 1800,
+    pool_timeout: float = 10.0,
+    ping_idle: float = 30.0,
+    sqlite_busy_timeout: float = 5.0,
+) -> Engine:
+    """
+    按 DSN 创建 engine，参数含义同 db.create_db_engine
+
+    Args:
+        sqlite_busy_timeout: SQLite 等待写锁的最长时间（秒）
+    """
+    if not is_sqlite(dsn):
+        return create_db_engine(
+            dsn,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=pool_recycle,
+            pool_timeout=pool_timeout,
+            ping_idle=ping_idle,
+        )
+
+    if _is_memory(dsn):
+        # 每个连接都是一个独立的内存库：只保留一个连接、永不回收，请求在连接池上排队
+        pool_size, max_overflow, pool_recycle = 1, 0, -1
+    engine = create_db_engine(
+        dsn,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_timeout=pool_timeout,
+        # 本地文件不会被服务端断开，不需要探活
+        ping_idle=float("inf"),
+        # 连接在线程池中的不同线程间轮流使用（同一时刻只被一个 Session 持有）
+        connect_args={"check_same_thread": False},
+    )
+    _install_sqlite_pragmas(engine, sqlite_busy_timeout)
+    init_sqlite_schema(engine)
+    return engine
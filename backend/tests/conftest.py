@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与 benchmarks 相同：后端模块是 backend/ 下的平铺模块
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
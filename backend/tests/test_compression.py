@@ -0,0 +1,107 @@
+"""read_request_body / negotiate_encoding：大小上限、截断检测与 Accept-Encoding 协商"""
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+import compression
+from compression import BodyTooLarge, negotiate_encoding, read_request_body
+
+BODY = b'{"model":"m","max_tokens":16,"messages":[]}' * 200
+
+
+class _Request:
+    """只提供 read_request_body 用到的 headers 与 stream()"""
+
+    def __init__(self, data: bytes, encoding: str = "", chunk: int = 1024):
+        self.headers = {"content-encoding": encoding} if encoding else {}
+        self._chunks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+        self.consumed = 0
+
+    async def stream(self):
+        for piece in self._chunks:
+            self.consumed += 1
+            yield piece
+
+
+def _read(request, max_bytes=1 << 20, **kwargs):
+    return asyncio.run(read_request_body(request, max_bytes, **kwargs))
+
+
+def _encoded(encoding: str, data: bytes = BODY) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data)
+    if encoding == "deflate":
+        return zlib.compress(data)
+    return compression.zstandard.ZstdCompressor(write_checksum=True).compress(data)
+
+
+ENCODINGS = ["gzip", "deflate"] + (["zstd"] if compression.ZSTD_AVAILABLE else [])
+
+
+def test_identity_body_stops_reading_at_limit():
+    request = _Request(BODY, chunk=100)
+    with pytest.raises(BodyTooLarge):
+        _read(request, max_bytes=250)
+    # 超限后立即停止，不会把剩余数据读进内存
+    assert request.consumed == 3
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_round_trip_drops_raw_unless_forwarded(encoding):
+    data = _encoded(encoding)
+    decoded = _read(_Request(data, encoding))
+    assert decoded.content == BODY and decoded.raw is None
+    decoded = _read(_Request(data, encoding), keep_raw_encoding=encoding)
+    assert decoded.content == BODY and decoded.raw == data
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_truncated_stream_is_rejected(encoding):
+    data = _encoded(encoding)
+    with pytest.raises(ValueError, match="truncated"):
+        _read(_Request(data[:-6], encoding))
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_decompressed_size_is_limited(encoding):
+    with pytest.raises(BodyTooLarge):
+        _read(_Request(_encoded(encoding), encoding), max_bytes=len(BODY) - 1)
+
+
+@pytest.mark.skipif(not compression.ZSTD_AVAILABLE, reason="zstandard not installed")
+def test_zstd_multi_block_and_multi_frame():
+    compressor = compression.zstandard.ZstdCompressor()
+    chunker = compressor.compressobj()
+    # 每段强制结束一个块，得到多块的帧
+    flush_block = compression.zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    streamed = b"".join(
+        chunker.compress(BODY[i:i + 500]) + chunker.flush(flush_block) for i in range(0, len(BODY), 500)
+    ) + chunker.flush()
+    data = streamed + compressor.compress(b"tail")
+    assert _read(_Request(data, "zstd", chunk=7)).content == BODY + b"tail"
+    with pytest.raises(ValueError, match="truncated"):
+        _read(_Request(data[:-1], "zstd", chunk=7))
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip, deflate", "gzip"),
+        ("*", "gzip"),
+        ("gzip;q=0, *", None),
+        ("*;q=0", None),
+        ("identity", None),
+        ("", None),
+    ],
+)
+def test_negotiate_encoding_honours_explicit_refusal(header, expected):
+    assert negotiate_encoding(header) == expected
+
+
+@pytest.mark.skipif(not compression.ZSTD_AVAILABLE, reason="zstandard not installed")
+def test_negotiate_prefers_zstd_only_when_listed():
+    assert negotiate_encoding("gzip, zstd") == "zstd"
+    assert negotiate_encoding("zstd;q=0, gzip") == "gzip"
+    assert negotiate_encoding("*") == "gzip"
@@ -0,0 +1,187 @@
+"""IdempotencyStore：执行权获取、跟随、回放、请求体不一致与响应体上限"""
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyEntry, IdempotencyKeyMismatch, IdempotencyStore
+
+BODY = b'{"model":"m"}'
+
+
+async def _collect(entry: IdempotencyEntry, on_fail=None) -> list:
+    return [chunk async for chunk in entry.replay(on_fail=on_fail)]
+
+
+def test_first_request_owns_key_and_completed_response_is_replayed():
+    async def run():
+        store = IdempotencyStore()
+        entry, owner = await store.acquire("messages", "0xAbc", "k1", BODY, timeout=1)
+        assert owner
+        entry.start(200, "application/json")
+        entry.append(b'{"ok":')
+        entry.append(b"true}")
+        store.finish(entry, ok=True)
+
+        # 用户地址大小写不同视为同一用户
+        again, owner = await store.acquire("messages", "0xabc", "k1", BODY, timeout=1)
+        assert not owner and again is entry
+        assert again.state == IdempotencyEntry.COMPLETE
+        assert await _collect(again) == [b'{"ok":', b"true}"]
+
+    asyncio.run(run())
+
+
+def test_same_key_with_different_body_is_rejected():
+    async def run():
+        store = IdempotencyStore()
+        entry, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        entry.start(200, "application/json")
+        store.finish(entry, ok=True)
+        with pytest.raises(IdempotencyKeyMismatch):
+            await store.acquire("messages", "u", "k1", b'{"model":"other"}', timeout=1)
+        # 不同 scope / 用户互不影响
+        _, owner = await store.acquire("mcp_recharge", "u", "k1", b"other", timeout=1)
+        assert owner
+
+    asyncio.run(run())
+
+
+def test_duplicate_follows_in_flight_stream():
+    async def run():
+        store = IdempotencyStore()
+        entry, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+
+        async def original():
+            await asyncio.sleep(0.01)
+            entry.start(200, "text/event-stream")
+            for chunk in (b"a", b"b", b"c"):
+                entry.append(chunk)
+                await asyncio.sleep(0.01)
+            store.finish(entry, ok=True)
+
+        task = asyncio.create_task(original())
+        follower, owner = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        assert not owner and follower is entry
+        assert await _collect(follower) == [b"a", b"b", b"c"]
+        await task
+
+    asyncio.run(run())
+
+
+def test_failure_before_start_lets_waiter_take_over():
+    async def run():
+        store = IdempotencyStore()
+        entry, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            store.finish(entry, ok=False)
+
+        task = asyncio.create_task(fail())
+        retry, owner = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        assert owner and retry is not entry
+        await task
+
+    asyncio.run(run())
+
+
+def test_failure_mid_stream_ends_followers_with_error_chunk():
+    async def run():
+        store = IdempotencyStore()
+        entry, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        entry.start(200, "text/event-stream")
+        entry.append(b"a")
+        follower, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        replay = asyncio.create_task(_collect(follower, on_fail=b"error"))
+        await asyncio.sleep(0)
+        entry.append(b"b")
+        store.finish(entry, ok=False)
+        assert await replay == [b"a", b"b", b"error"]
+        assert store.total_bytes == 0
+        # 失败后 key 被释放，重试重新执行
+        _, owner = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        assert owner
+
+    asyncio.run(run())
+
+
+def test_waiting_for_unstarted_request_times_out():
+    async def run():
+        store = IdempotencyStore()
+        await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        with pytest.raises(asyncio.TimeoutError):
+            await store.acquire("messages", "u", "k1", BODY, timeout=0.01)
+
+    asyncio.run(run())
+
+
+def test_oversized_response_keeps_tombstone_instead_of_releasing_key():
+    async def run():
+        store = IdempotencyStore(max_entry_bytes=4)
+        entry, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        entry.start(200, "text/event-stream")
+        entry.append(b"abc")
+        entry.append(b"def")
+        # 超过上限后停止缓冲，已记录的分块也被释放
+        assert entry.truncated and entry.chunks == [] and store.total_bytes == 0
+        entry.append(b"ghi")
+        assert entry.chunks == []
+        store.finish(entry, ok=True)
+
+        retry, owner = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        assert not owner and retry.truncated
+        assert retry.state == IdempotencyEntry.COMPLETE and retry.status_code == 200
+
+    asyncio.run(run())
+
+
+def test_follower_of_truncated_stream_gets_error_chunk():
+    async def run():
+        store = IdempotencyStore(max_entry_bytes=2)
+        entry, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        entry.start(200, "text/event-stream")
+        entry.append(b"a")
+        follower, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        replay = asyncio.create_task(_collect(follower, on_fail=b"error"))
+        await asyncio.sleep(0)
+        entry.append(b"bc")
+        store.finish(entry, ok=True)
+        assert await replay == [b"a", b"error"]
+
+    asyncio.run(run())
+
+
+def test_total_byte_budget_drops_oldest_completed_bodies():
+    async def run():
+        store = IdempotencyStore(max_entry_bytes=10, max_total_bytes=10)
+        first, _ = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        first.start(200, "application/json")
+        first.append(b"x" * 6)
+        store.finish(first, ok=True)
+
+        second, _ = await store.acquire("messages", "u", "k2", BODY, timeout=1)
+        second.start(200, "application/json")
+        second.append(b"y" * 6)
+        store.finish(second, ok=True)
+
+        # 第一条的响应体被丢弃，但 key 仍在，不会被重新执行
+        assert first.truncated and not second.truncated
+        assert store.total_bytes == 6
+        retry, owner = await store.acquire("messages", "u", "k1", BODY, timeout=1)
+        assert not owner and retry.truncated
+
+    asyncio.run(run())
+
+
+def test_purged_entries_release_bytes():
+    async def run():
+        store = IdempotencyStore(max_entries=1)
+        for key in ("k1", "k2"):
+            entry, _ = await store.acquire("messages", "u", key, BODY, timeout=1)
+            entry.start(200, "application/json")
+            entry.append(b"x" * 5)
+            store.finish(entry, ok=True)
+        await store.acquire("messages", "u", "k3", BODY, timeout=1)
+        assert store.total_bytes == 5
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+"""PromptRefStore / expand_refs：引用只对上传它的用户有效（内存与磁盘）"""
+import asyncio
+
+import pytest
+
+from prompt_refs import PromptRefStore, UnknownRefs, expand_refs
+
+TOOLS = b'[{"name":"t","input_schema":{"type":"object"}}]'
+ALICE = "0x" + "a" * 40
+BOB = "0x" + "b" * 40
+
+
+@pytest.fixture(params=["memory", "disk"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return PromptRefStore()
+    return PromptRefStore(directory=str(tmp_path))
+
+
+def _expand(store, owner, ref):
+    body = b'{"model":"m","tools_ref":"' + ref.encode() + b'"}'
+    return asyncio.run(expand_refs(body, store, owner))
+
+
+def test_owner_can_expand_own_ref(store):
+    ref = asyncio.run(store.put(TOOLS, ALICE))
+    # 地址大小写不同视为同一用户
+    assert _expand(store, ALICE.upper().replace("0X", "0x"), ref) == b'{"model":"m","tools":' + TOOLS + b"}"
+
+
+@pytest.mark.parametrize("owner", [BOB, None])
+def test_other_users_cannot_expand_ref(store, owner):
+    ref = asyncio.run(store.put(TOOLS, ALICE))
+    with pytest.raises(UnknownRefs) as e:
+        _expand(store, owner, ref)
+    assert e.value.refs == [ref]
+
+
+def test_disk_refs_stay_namespaced_after_restart(tmp_path):
+    ref = asyncio.run(PromptRefStore(directory=str(tmp_path)).put(TOOLS, ALICE))
+    restarted = PromptRefStore(directory=str(tmp_path))
+    assert asyncio.run(restarted.get(ref, BOB)) is None
+    assert asyncio.run(restarted.get(ref, ALICE)) == TOOLS
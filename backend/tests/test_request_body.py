@@ -0,0 +1,54 @@
+"""parse_message_head：扣费前拒绝上游必然返回 400 的请求体（msgspec 与回退解析器行为一致）"""
+import importlib
+import sys
+
+import pytest
+
+import request_body
+
+VALID = b'{"model":"m","max_tokens":16,"messages":[{"role":"user","content":"hi"}],"stream":true}'
+
+
+def _fallback_module():
+    """屏蔽 msgspec 重新导入，得到 orjson / json 回退解析器"""
+    saved = sys.modules.get("msgspec")
+    sys.modules["msgspec"] = None
+    try:
+        return importlib.reload(request_body)
+    finally:
+        if saved is None:
+            sys.modules.pop("msgspec", None)
+        else:
+            sys.modules["msgspec"] = saved
+        importlib.reload(request_body)
+
+
+@pytest.fixture(params=["default", "fallback"])
+def parse(request):
+    if request.param == "default":
+        return request_body.parse_message_head, request_body.InvalidRequestBody
+    module = _fallback_module()
+    return module.parse_message_head, module.InvalidRequestBody
+
+
+def test_valid_body(parse):
+    parse_head, _ = parse
+    head = parse_head(VALID)
+    assert (head.model, head.max_tokens, head.stream) == ("m", 16, True)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        # 缺少 max_tokens：上游必填，代理原样转发，不能先按默认值扣费
+        b'{"model":"m","messages":[{"role":"user","content":"hi"}]}',
+        b'{"model":"m","max_tokens":null,"messages":[{"role":"user","content":"hi"}]}',
+        b'{"model":"m","max_tokens":0,"messages":[{"role":"user","content":"hi"}]}',
+        b'{"model":"m","max_tokens":16,"messages":[]}',
+        b'{"model":"m","max_tokens":16,"messages":[{"content":"hi"}]}',
+    ],
+)
+def test_rejects_bodies_upstream_would_reject(parse, body):
+    parse_head, invalid = parse
+    with pytest.raises(invalid):
+        parse_head(body)
@@ -0,0 +1,232 @@
+"""
+分布式追踪（OpenTelemetry，可选依赖）
+
+在签名校验、链上转账校验、Facilitator 结算、RPC 调用、SQL 事务块和 Claude 上游请求周围记录 span，
+按 OTLP/HTTP 发送到本地 collector，用于定位一次慢请求（如 mcp_recharge）的时间花在哪里。
+
+- 未安装 opentelemetry 或未开启 TRACING_ENABLED 时，span() 直接返回一个空对象，
+  每个埋点只多一次全局变量判断
+- 头部采样：入口请求按 sample_ratio 决定是否采样，子 span 跟随父 span；
+  请求头带 traceparent 时沿用调用方的追踪与采样决定
+- 调用 Claude 上游时注入 traceparent，上游也接入追踪时可以串起来
+- 慢请求记录开启时（profiling.SlowRequestMiddleware），同一批 span 的耗时还会按名称累加到
+  当前请求的阶段耗时中，与是否开启追踪无关
+"""
+import contextvars
+import functools
+import logging
+import time
+from typing import Optional
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+_provider = None
+
+# 当前请求的阶段耗时：span 名称 -> [次数, 累计秒数]（由 profiling.SlowRequestMiddleware 设置）
+phase_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("phase_timings", default=None)
+
+
+class _NoopSpan:
+    """关闭追踪时的 span：同时可以作为上下文管理器和手动结束的 span 使用"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value) -> None:
+        pass
+
+    def record_exception(self, exception) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _TimedSpan:
+    """把 with 块的耗时累加到阶段耗时中，开启追踪时同时进入 OTel span"""
+
+    __slots__ = ("name", "timings", "inner", "started")
+
+    def __init__(self, name: str, timings: dict, inner=None):
+        self.name = name
+        self.timings = timings
+        self.inner = inner
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self.inner.__enter__() if self.inner is not None else NOOP_SPAN
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        entry = self.timings.get(self.name)
+        if entry is None:
+            self.timings[self.name] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+        if self.inner is not None:
+            return self.inner.__exit__(*exc_info)
+        return False
+
+
+def setup_tracing(
+    enabled: bool,
+    endpoint: str = "http://localhost:4318/v1/traces",
+    sample_ratio: float = 0.1,
+    service_name: str = "blitz-x402-backend",
+) -> bool:
+    """
+    初始化追踪，返回是否实际开启
+
+    Args:
+        enabled: 是否开启
+        endpoint: OTLP/HTTP collector 地址
+        sample_ratio: 入口请求的采样比例（0~1）
+        service_name: 上报的服务名
+    """
+    global _tracer, _provider
+    if not enabled:
+        return False
+    if not OTEL_AVAILABLE:
+        logger.warning("TRACING_ENABLED=true but opentelemetry is not installed, tracing disabled")
+        return False
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    # 批量异步导出：span 结束时只入队，collector 不可用也不阻塞请求
+    _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    _tracer = _provider.get_tracer("blitz_x402")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """导出剩余的 span"""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = _provider = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, attributes: Optional[dict] = None):
+    """当前上下文中的子 span（with 语句）；关闭追踪且不记录阶段耗时时返回空对象"""
+    timings = phase_timings.get()
+    if _tracer is None:
+        return NOOP_SPAN if timings is None else _TimedSpan(name, timings)
+    inner = _tracer.start_as_current_span(name, attributes=attributes)
+    return inner if timings is None else _TimedSpan(name, timings, inner)
+
+
+def start_span(name: str, attributes: Optional[dict] = None):
+    """手动结束的 span（跨越多个 await / 流式生成器时使用），调用方负责 end()"""
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.start_span(name, attributes=attributes)
+
+
+def use_span(span_obj):
+    """在 with 块内把 start_span 创建的 span 设为当前 span（子 span 与 traceparent 以它为父），退出时不结束"""
+    if span_obj is NOOP_SPAN:
+        return NOOP_SPAN
+    return trace.use_span(span_obj, end_on_exit=False)
+
+
+def end_span(span_obj, error: Optional[BaseException] = None) -> None:
+    """结束 start_span 创建的 span，可附带异常；已结束的 span 重复调用时忽略"""
+    if span_obj is NOOP_SPAN or not span_obj.is_recording():
+        return
+    if error is not None:
+        span_obj.record_exception(error)
+        span_obj.set_status(Status(StatusCode.ERROR, str(error)))
+    span_obj.end()
+
+
+def traced(name: str):
+    """同步函数装饰器：整个调用包在一个 span 里"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None and phase_timings.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject_headers(headers: dict) -> None:
+    """把当前追踪上下文写入出站请求头（traceparent）"""
+    if _tracer is not None:
+        propagate.inject(headers)
+
+
+class TracingMiddleware:
+    """
+    ASGI 中间件：每个 HTTP 请求一个入口 span，沿用请求头中的 traceparent
+
+    span 名称用路由模板（如 GET /api/v1/balance/{user_address}），路由匹配后才知道，
+    创建时先只用方法名；原始路径只放在 http.target 属性中，避免名称基数随地址无限增长。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _tracer is None or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        carrier = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", ())}
+        status = {}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with _tracer.start_as_current_span(
+            scope["method"],
+            context=propagate.extract(carrier),
+            kind=SpanKind.SERVER,
+            attributes={"http.method": scope["method"], "http.target": scope["path"]},
+        ) as server_span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # 路由匹配时 FastAPI 把命中的路由写回同一个 scope
+                route = scope.get("route")
+                template = getattr(route, "path", None)
+                if template:
+                    server_span.update_name(f"{scope['method']} {template}")
+                    server_span.set_attribute("http.route", template)
+                if "code" in status:
+                    server_span.set_attribute("http.status_code", status["code"])
+                    if status["code"] >= 500:
+                        server_span.set_status(Status(StatusCode.ERROR))
@@ -0,0 +1,312 @@
+"""
+Claude 上游调用层
+
+功能：
+1. 多上游地址故障转移（按顺序尝试，失败的上游短暂冷却）
+2. 带抖动的指数退避重试（仅在首字节发给客户端之前）
+3. 非流式请求对冲（超过近期 p95 延迟仍未返回时，向另一个上游再发一次）
+4. 分级超时：连接 / 首字节 / 流式空闲 / 总时长（空闲由调用方逐行控制）
+
+计费只在代理入口预扣一次；重试与对冲中被丢弃的响应不会记录 usage，
+因此无论尝试多少次都只结算胜出的那一个响应。
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 可以安全重试的上游状态码（429 限流、5xx、529 overloaded）
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+
+
+class UpstreamTimeout(httpx.TimeoutException):
+    """上游超时，kind 为 connect / first_byte / idle / total"""
+
+    def __init__(self, kind: str):
+        super().__init__(f"Upstream {kind} timeout")
+        self.kind = kind
+
+
+class UpstreamPool:
+    """多上游 Claude 服务的共享连接池与重试/对冲策略"""
+
+    def __init__(
+        self,
+        urls: list[str],
+        connect_timeout: float = 10.0,
+        first_byte_timeout: float = 60.0,
+        idle_timeout: float = 60.0,
+        total_timeout: float = 300.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        failure_cooldown: float = 10.0,
+        hedge_enabled: bool = False,
+        hedge_max_ratio: float = 0.05,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20,
+    ):
+        self.urls = [u for u in urls if u]
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.idle_timeout = idle_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_cooldown = failure_cooldown
+        self.hedge_enabled = hedge_enabled
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cooldown_until: dict[str, float] = {}
+        self._latencies: deque = deque(maxlen=500)
+        self._requests = 0
+        self._hedges = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的 keep-alive 客户端（首次使用时创建）"""
+        if self._client is None:
+            # 读超时放宽到总时长，首字节/空闲/总时长由本层用 asyncio 控制
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.total_timeout, connect=self.connect_timeout)
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------- 上游选择 ----------
+
+    def _candidates(self) -> list[str]:
+        """按优先级返回上游列表，冷却中的上游排在最后"""
+        now = time.monotonic()
+        healthy = [u for u in self.urls if self._cooldown_until.get(u, 0) <= now]
+        cooling = [u for u in self.urls if self._cooldown_until.get(u, 0) > now]
+        return healthy + cooling
+
+    def _mark_failure(self, url: str) -> None:
+        self._cooldown_until[url] = time.monotonic() + self.failure_cooldown
+
+    def _mark_success(self, url: str) -> None:
+        self._cooldown_until.pop(url, None)
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """全抖动指数退避；上游给出 Retry-After 时优先使用（不超过上限）"""
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    # ---------- 超时 ----------
+
+    async def _with_timeout(self, coro, timeout: float, kind: str):
+        """在限定时间内等待上游，超时转换为带类型标签的 UpstreamTimeout"""
+        try:
+            return await asyncio.wait_for(coro, max(timeout, 0))
+        except asyncio.TimeoutError:
+            metrics.CLAUDE_UPSTREAM_TIMEOUTS.inc(kind=kind)
+            raise UpstreamTimeout(kind)
+        except httpx.ConnectTimeout:
+            metrics.CLAUDE_UPSTREAM_TIMEOUTS.inc(kind="connect")
+            raise
+
+    # ---------- 对冲 ----------
+
+    def _p95(self) -> Optional[float]:
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _hedge_delay(self) -> Optional[float]:
+        """对冲等待时间；样本不足、关闭或超出对冲预算时返回 None"""
+        if not self.hedge_enabled or len(self.urls) < 2:
+            return None
+        if self._hedges + 1 > self._requests * self.hedge_max_ratio:
+            return None
+        p95 = self._p95()
+        if p95 is None:
+            return None
+        return max(p95, self.hedge_min_delay)
+
+    # ---------- 请求 ----------
+
+    async def send_stream(
+        self, content: bytes, headers: dict, deadline: Optional[float] = None
+    ) -> httpx.Response:
+        """
+        打开流式上游请求
+
+        只在收到响应头之前重试/故障转移；返回的响应由调用方负责 aclose()。
+        返回非 200 响应表示上游给出了不可重试的错误，或重试次数已用完。
+        每次尝试受首字节超时约束，所有尝试共享总时长预算。
+
+        Args:
+            content: 请求体
+            headers: 请求头
+            deadline: 总时长截止时间（time.monotonic()），默认从现在起 total_timeout
+
+        Raises:
+            httpx.RequestError / httpx.TimeoutException: 所有尝试都失败
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.total_timeout
+        candidates = self._candidates()
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            url = candidates[attempt % len(candidates)]
+            request = self.client.build_request("POST", url, content=content, headers=headers)
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= self.first_byte_timeout:
+                    response = await self._with_timeout(
+                        self.client.send(request, stream=True), remaining, "total"
+                    )
+                else:
+                    response = await self._with_timeout(
+                        self.client.send(request, stream=True), self.first_byte_timeout, "first_byte"
+                    )
+            except httpx.RequestError as e:
+                last_error = e
+                self._mark_failure(url)
+                if attempt < self.max_retries and deadline > time.monotonic():
+                    metrics.CLAUDE_UPSTREAM_RETRIES.inc(reason=type(e).__name__)
+                    await asyncio.sleep(min(self._backoff(attempt), deadline - time.monotonic()))
+                    continue
+                raise
+
+            if (
+                response.status_code in RETRYABLE_STATUS
+                and attempt < self.max_retries
+                and deadline > time.monotonic()
+            ):
+                await response.aclose()
+                self._mark_failure(url)
+                metrics.CLAUDE_UPSTREAM_RETRIES.inc(reason=str(response.status_code))
+                logger.warning("Upstream %s returned %s, retrying (attempt %d)", url, response.status_code, attempt + 1)
+                await asyncio.sleep(min(self._backoff(attempt, response), deadline - time.monotonic()))
+                continue
+
+            if response.status_code == 200:
+                self._mark_success(url)
+            return response
+
+        raise last_error
+
+    async def post(self, content: bytes, headers: dict) -> httpx.Response:
+        """
+        非流式上游请求：重试 + 故障转移 + 可选对冲
+
+        Returns:
+            已读取完整响应体的 httpx.Response
+
+        Raises:
+            httpx.RequestError / httpx.TimeoutException: 所有尝试都失败
+        """
+        self._requests += 1
+        deadline = time.monotonic() + self.total_timeout
+        candidates = self._candidates()
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            url = candidates[attempt % len(candidates)]
+            try:
+                response = await self._with_timeout(
+                    self._post_with_hedge(url, candidates, content, headers),
+                    deadline - time.monotonic(),
+                    "total",
+                )
+            except httpx.RequestError as e:
+                last_error = e
+                self._mark_failure(url)
+                if attempt < self.max_retries and deadline > time.monotonic():
+                    metrics.CLAUDE_UPSTREAM_RETRIES.inc(reason=type(e).__name__)
+                    await asyncio.sleep(min(self._backoff(attempt), deadline - time.monotonic()))
+                    continue
+                raise
+
+            if (
+                response.status_code in RETRYABLE_STATUS
+                and attempt < self.max_retries
+                and deadline > time.monotonic()
+            ):
+                self._mark_failure(url)
+                metrics.CLAUDE_UPSTREAM_RETRIES.inc(reason=str(response.status_code))
+                logger.warning("Upstream %s returned %s, retrying (attempt %d)", url, response.status_code, attempt + 1)
+                await asyncio.sleep(min(self._backoff(attempt, response), deadline - time.monotonic()))
+                continue
+
+            return response
+
+        raise last_error
+
+    async def _timed_post(self, url: str, content: bytes, headers: dict) -> httpx.Response:
+        started = time.monotonic()
+        response = await self.client.post(url, content=content, headers=headers)
+        if response.status_code == 200:
+            self._latencies.append(time.monotonic() - started)
+            self._mark_success(url)
+        return response
+
+    async def _post_with_hedge(
+        self, url: str, candidates: list[str], content: bytes, headers: dict
+    ) -> httpx.Response:
+        """主请求超过对冲延迟仍未返回时，向下一个上游发出对冲请求，取先成功者"""
+        primary = asyncio.ensure_future(self._timed_post(url, content, headers))
+        delay = self._hedge_delay()
+        if delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge_url = next((u for u in candidates if u != url), url)
+            self._hedges += 1
+            metrics.CLAUDE_UPSTREAM_HEDGES.inc(outcome="issued")
+            hedge = asyncio.ensure_future(self._timed_post(hedge_url, content, headers))
+            pending.add(hedge)
+
+            last_error: Optional[Exception] = None
+            fallback: Optional[httpx.Response] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    response = task.result()
+                    if response.status_code in RETRYABLE_STATUS:
+                        fallback = response
+                        continue
+                    if task is hedge:
+                        metrics.CLAUDE_UPSTREAM_HEDGES.inc(outcome="won")
+                    return response
+            if fallback is not None:
+                return fallback
+            raise last_error
+        finally:
+            # 丢弃落败的请求：取消后不会产生 usage 记录
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
@@ -11,6 +11,7 @@ x402 Facilitator - 模仿 thirdweb 实现
 
 import os
 import json
+import logging
 import time
 from typing import Optional, Dict, Any
 from decimal import Decimal
@@ -19,10 +20,18 @@ from eth_account import Account
 from eth_account.messages import encode_defunct
 from dotenv import load_dotenv
 
+import metrics
+import tracing
+from rpc_pool import make_web3
+from chain_cache import ChainStateCache
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 配置
 RPC_URL = os.getenv("RPC_URL", "https://testnet-rpc.monad.xyz")
+RPC_URLS = [u.strip() for u in os.getenv("RPC_URLS", "").split(",") if u.strip()]  # 备用 RPC 节点（逗号分隔）
 CHAIN_ID = int(os.getenv("CHAIN_ID", "10143"))
 FACILITATOR_PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")  # Facilitator 服务账户私钥
 FACILITATOR_ADDRESS = None  # 从私钥推导
@@ -31,7 +40,19 @@ if FACILITATOR_PRIVATE_KEY:
     FACILITATOR_ADDRESS = Account.from_key(FACILITATOR_PRIVATE_KEY).address
 
 # 初始化 Web3
-w3 = Web3(Web3.HTTPProvider(RPC_URL))
+w3 = make_web3(RPC_URL, RPC_URLS)
+
+# 链上状态微缓存（Facilitator 账户的余额后台刷新；后台任务由 main.py 启动）
+# CHAIN_NONCE_LOCAL 时 nonce 在进程内分配，与 main 的服务账户（同一 PRIVATE_KEY）共用 nonce_allocator
+chain_state = ChainStateCache(
+    w3,
+    name="facilitator",
+    ttl=float(os.getenv("CHAIN_CACHE_TTL", "2")),
+    max_stale=float(os.getenv("CHAIN_CACHE_MAX_STALE", "30")),
+    poll_interval=float(os.getenv("CHAIN_CACHE_POLL_INTERVAL", "1")),
+    watch=[FACILITATOR_ADDRESS] if FACILITATOR_ADDRESS else [],
+    local_nonce=os.getenv("CHAIN_NONCE_LOCAL", "false").lower() == "true",
+)
 
 
 def mon_to_wei(mon_amount: str) -> int:
@@ -90,6 +111,7 @@ def create_payment_message(
     return json.dumps(message, sort_keys=True)
 
 
+@tracing.traced("verify_payment_signature")
 def verify_payment_signature(
     user_address: str,
     pay_to: str,
@@ -124,12 +146,12 @@ def verify_payment_signature(
         # 验证地址是否匹配
         is_valid = recovered_address.lower() == user_address.lower()
         if is_valid:
-            print(f"[Facilitator] Payment signature verified for user: {user_address}")
+            logger.info("Payment signature verified", extra={"user": user_address})
         else:
-            print(f"[Facilitator] Signature mismatch: expected {user_address}, got {recovered_address}")
+            logger.info("Signature mismatch", extra={"user": user_address, "recovered": recovered_address})
         return is_valid
     except Exception as e:
-        print(f"[Facilitator] Signature verification failed: {e}")
+        logger.info("Signature verification failed: %s", e)
         return False
 
 
@@ -137,6 +159,7 @@ def verify_payment_signature(
 _processed_payment_ids = set()
 
 
+@tracing.traced("settle_payment")
 def settle_payment(
     user_address: str,
     pay_to: str,
@@ -144,6 +167,23 @@ def settle_payment(
     payment_signature: str,
     payment_id: Optional[str] = None,
     chain_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """结算支付（记录从验签到收到收据的耗时，参数与返回值见 _settle_payment）"""
+    started = time.perf_counter()
+    result = _settle_payment(user_address, pay_to, amount_wei, payment_signature, payment_id, chain_id)
+    metrics.CHAIN_PAYMENT_SECONDS.observe(
+        time.perf_counter() - started, payer="facilitator", result="ok" if result["success"] else "failed"
+    )
+    return result
+
+
+def _settle_payment(
+    user_address: str,
+    pay_to: str,
+    amount_wei: int,
+    payment_signature: str,
+    payment_id: Optional[str] = None,
+    chain_id: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
     结算支付（Facilitator 核心功能）
@@ -188,35 +228,40 @@ def settle_payment(
                     "success": False,
                     "error": f"Payment ID {payment_id} has already been processed (replay attack prevented)"
                 }
-            print(f"[Facilitator] Payment ID: {payment_id}")
+            logger.info("Settling payment", extra={"payment_id": payment_id})
         
         # 2. 验证支付签名
-        print(f"[Facilitator] Verifying payment signature...")
         if not verify_payment_signature(user_address, pay_to, amount_wei, payment_signature, chain_id):
             return {
                 "success": False,
                 "error": "Invalid payment signature"
             }
         
-        print(f"[Facilitator] Payment signature verified for user: {user_address}")
-        
         # 3. 记录 payment_id（在验证签名成功后）
         if payment_id:
             _processed_payment_ids.add(payment_id)
-            print(f"[Facilitator] Payment ID recorded: {payment_id}")
+            logger.info("Payment ID recorded", extra={"payment_id": payment_id})
         
         # 2. 检查 Facilitator 账户余额
         facilitator_account = Account.from_key(FACILITATOR_PRIVATE_KEY)
         facilitator_address = facilitator_account.address
         
-        balance_wei = w3.eth.get_balance(facilitator_address)
+        balance_wei = chain_state.balance(facilitator_address)
         estimated_gas = 21000
-        gas_price = w3.eth.gas_price
+        gas_price = chain_state.gas_price()
         total_cost = amount_wei + (estimated_gas * gas_price)
+        if balance_wei < total_cost:
+            # 缓存的余额可能是旧值：不足时再向节点确认一次
+            balance_wei = chain_state.balance(facilitator_address, force=True)
         
-        print(f"[Facilitator] Facilitator balance: {wei_to_mon(balance_wei)} MON")
-        print(f"[Facilitator] Payment amount: {wei_to_mon(amount_wei)} MON")
-        print(f"[Facilitator] Estimated gas cost: {wei_to_mon(estimated_gas * gas_price)} MON")
+        logger.info(
+            "Facilitator balance checked",
+            extra={
+                "balance_mon": wei_to_mon(balance_wei),
+                "amount_mon": wei_to_mon(amount_wei),
+                "gas_cost_mon": wei_to_mon(estimated_gas * gas_price),
+            },
+        )
         
         if balance_wei < total_cost:
             return {
@@ -225,33 +270,30 @@ def settle_payment(
             }
         
         # 5. 构建并发送交易（从 Facilitator 账户支付到 pay_to）
-        nonce = w3.eth.get_transaction_count(facilitator_address)
-        
-        transaction = {
-            "to": Web3.to_checksum_address(pay_to),
-            "value": amount_wei,
-            "gas": estimated_gas,
-            "gasPrice": gas_price,
-            "nonce": nonce,
-            "chainId": chain_id,
-        }
-        
-        # 签名交易
-        signed_txn = facilitator_account.sign_transaction(transaction)
-        
-        # 发送交易
-        print(f"[Facilitator] Sending payment transaction...")
-        tx_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+        def sign(nonce: int) -> bytes:
+            transaction = {
+                "to": Web3.to_checksum_address(pay_to),
+                "value": amount_wei,
+                "gas": estimated_gas,
+                "gasPrice": gas_price,
+                "nonce": nonce,
+                "chainId": chain_id,
+            }
+            return facilitator_account.sign_transaction(transaction).rawTransaction
+
+        # 发送交易（nonce 冲突时重新同步后重发一次）
+        tx_hash, nonce = chain_state.send_transaction(facilitator_address, sign)
+        chain_state.note_spent(facilitator_address, total_cost)
         tx_hash_hex = tx_hash.hex()
         
-        print(f"[Facilitator] Transaction sent: {tx_hash_hex}")
+        logger.info("Transaction sent", extra={"tx_hash": tx_hash_hex, "nonce": nonce})
         
         # 6. 等待确认
-        print(f"[Facilitator] Waiting for confirmation...")
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        with tracing.span("wait_for_receipt", {"tx_hash": tx_hash_hex}):
+            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
         
         if receipt.status == 1:
-            print(f"[Facilitator] ✅ Payment settled successfully in block {receipt.blockNumber}")
+            logger.info("Payment settled in block %s", receipt.blockNumber, extra={"tx_hash": tx_hash_hex})
             return {
                 "success": True,
                 "tx_hash": tx_hash_hex,
@@ -267,7 +309,7 @@ def settle_payment(
             }
             
     except Exception as e:
-        print(f"[Facilitator] Error settling payment: {e}")
+        logger.warning("Error settling payment: %s", e)
         return {
             "success": False,
             "error": str(e)
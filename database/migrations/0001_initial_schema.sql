@@ -0,0 +1,19 @@
+-- 初始表结构（与早期 start_mysql.sh 创建的结构一致，已存在时跳过）
+CREATE TABLE IF NOT EXISTS user_balances (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  user_address VARCHAR(42) NOT NULL UNIQUE,
+  balance DECIMAL(36, 0) NOT NULL DEFAULT 0, -- 单位：wei
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS recharge_records (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  user_address VARCHAR(42) NOT NULL,
+  amount DECIMAL(36, 0) NOT NULL,      -- 单位：wei
+  tx_hash VARCHAR(66) NOT NULL,
+  client_type VARCHAR(16) NOT NULL,    -- "mcp" / "web" / "x402-gateway" 等
+  status VARCHAR(16) NOT NULL,         -- "pending" / "success" / "failed"
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY uniq_user_tx (user_address, tx_hash)
+);
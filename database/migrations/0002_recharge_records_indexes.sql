@@ -0,0 +1,10 @@
+-- recharge_records 索引调整
+-- 1. tx_hash 全局唯一：一笔链上交易只能入账一次，入账语句直接依赖该唯一键去重
+--    （执行前请确认没有重复 tx_hash：SELECT tx_hash FROM recharge_records GROUP BY tx_hash HAVING COUNT(*) > 1）
+-- 2. (user_address, created_at)：按用户查询充值历史（取代 uniq_user_tx 的前缀用途）
+-- 3. (status, created_at)：按状态扫描 pending / failed 记录（对账、重试）
+ALTER TABLE recharge_records
+  ADD UNIQUE KEY uniq_tx_hash (tx_hash),
+  ADD KEY idx_user_created (user_address, created_at),
+  ADD KEY idx_status_created (status, created_at),
+  DROP KEY uniq_user_tx;
@@ -0,0 +1,24 @@
+-- 余额事件账本（只追加）与快照
+-- 当前余额 = 最新快照 + 快照之后 credit / reserve / refund 事件的 amount 之和
+CREATE TABLE IF NOT EXISTS balance_events (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  user_address VARCHAR(42) NOT NULL,
+  kind VARCHAR(16) NOT NULL,           -- "credit" / "reserve" / "settle" / "refund"
+  amount DECIMAL(36, 0) NOT NULL,      -- 余额变化（wei，有符号）；settle 为实际消耗，不计入余额
+  ref VARCHAR(80) NULL,                -- credit 为 tx_hash，reserve / settle / refund 为请求 ID
+  created_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+  KEY idx_user_id (user_address, id),
+  KEY idx_ref (ref)
+);
+
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+  user_address VARCHAR(42) NOT NULL,
+  last_event_id BIGINT NOT NULL,       -- 快照包含的最后一个事件 ID
+  balance DECIMAL(36, 0) NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_address, last_event_id)
+);
+
+-- 以当前余额作为每个用户的初始快照
+INSERT IGNORE INTO balance_snapshots (user_address, last_event_id, balance)
+SELECT user_address, 0, balance FROM user_balances;
@@ -0,0 +1,9 @@
+-- 热点账户余额分片：余额 = user_balances.balance + 各分片之和
+-- 扣费随机选择余额足够的分片，后台任务定期把资金在主行与分片之间重新均分
+CREATE TABLE IF NOT EXISTS user_balance_shards (
+  user_address VARCHAR(42) NOT NULL,
+  shard SMALLINT NOT NULL,
+  balance DECIMAL(36, 0) NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_address, shard)
+);
@@ -0,0 +1,5 @@
+-- 确认深度与 reorg 处理：status 增加 "pending"（已临时入账，等待确认）与 "reversed"（reorg 后撤销）
+ALTER TABLE recharge_records
+  ADD COLUMN block_number BIGINT NULL AFTER status,
+  ADD COLUMN block_hash VARCHAR(66) NULL AFTER block_number,
+  ADD COLUMN confirmations INT NOT NULL DEFAULT 0 AFTER block_hash;
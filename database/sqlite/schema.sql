@@ -0,0 +1,52 @@
+-- SQLite 表结构（对应 migrations/0001..0005 执行后的 MySQL 结构，所有语句可重复执行）
+-- 金额列（wei）存十进制文本：SQLite 的 INTEGER 只有 64 位（约 9.22 MON），MySQL 为 DECIMAL(36, 0)；
+-- 运算由 storage.py 注册的 wei_add / wei_sub / wei_cmp / wei_sum 完成，CHECK 只允许数字与负号组成的文本（拒绝浮点数、科学计数法）
+CREATE TABLE IF NOT EXISTS user_balances (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_address VARCHAR(42) NOT NULL UNIQUE,
+  balance TEXT NOT NULL DEFAULT '0' CHECK (balance NOT GLOB '*[^0-9-]*' AND balance GLOB '*[0-9]'),
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS recharge_records (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_address VARCHAR(42) NOT NULL,
+  amount TEXT NOT NULL CHECK (amount NOT GLOB '*[^0-9-]*' AND amount GLOB '*[0-9]'),
+  tx_hash VARCHAR(66) NOT NULL UNIQUE,
+  client_type VARCHAR(16) NOT NULL,
+  status VARCHAR(16) NOT NULL,
+  block_number BIGINT NULL,
+  block_hash VARCHAR(66) NULL,
+  confirmations INT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_recharge_user_created ON recharge_records (user_address, created_at);
+CREATE INDEX IF NOT EXISTS idx_recharge_status_created ON recharge_records (status, created_at);
+
+CREATE TABLE IF NOT EXISTS balance_events (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,  -- AUTOINCREMENT：ID 不复用，快照水位依赖单调递增
+  user_address VARCHAR(42) NOT NULL,
+  kind VARCHAR(16) NOT NULL,
+  amount TEXT NOT NULL CHECK (amount NOT GLOB '*[^0-9-]*' AND amount GLOB '*[0-9]'),
+  ref VARCHAR(80) NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_event_user_id ON balance_events (user_address, id);
+CREATE INDEX IF NOT EXISTS idx_event_ref ON balance_events (ref);
+
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+  user_address VARCHAR(42) NOT NULL,
+  last_event_id BIGINT NOT NULL,
+  balance TEXT NOT NULL CHECK (balance NOT GLOB '*[^0-9-]*' AND balance GLOB '*[0-9]'),
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_address, last_event_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_balance_shards (
+  user_address VARCHAR(42) NOT NULL,
+  shard SMALLINT NOT NULL,
+  balance TEXT NOT NULL DEFAULT '0' CHECK (balance NOT GLOB '*[^0-9-]*' AND balance GLOB '*[0-9]'),
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_address, shard)
+);
@@ -29,29 +29,22 @@ echo "Waiting MySQL to be ready..."
 # 简单等待几秒，也可以改成更严格的健康检查
 sleep 15
 
-echo "Creating tables in database ${MYSQL_DB}..."
-
-docker exec -i "${CONTAINER_NAME}" mysql -u"${MYSQL_USER}" -p"${MYSQL_PASSWORD}" "${MYSQL_DB}" << 'SQL'
-CREATE TABLE IF NOT EXISTS user_balances (
-  id BIGINT PRIMARY KEY AUTO_INCREMENT,
-  user_address VARCHAR(42) NOT NULL UNIQUE,
-  balance DECIMAL(36, 0) NOT NULL DEFAULT 0, -- 单位：wei
-  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
-
-CREATE TABLE IF NOT EXISTS recharge_records (
-  id BIGINT PRIMARY KEY AUTO_INCREMENT,
-  user_address VARCHAR(42) NOT NULL,
-  amount DECIMAL(36, 0) NOT NULL,      -- 单位：wei
-  tx_hash VARCHAR(66) NOT NULL,
-  client_type VARCHAR(16) NOT NULL,    -- "mcp" / "web" / "x402-gateway" 等
-  status VARCHAR(16) NOT NULL,         -- "pending" / "success" / "failed"
-  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  UNIQUE KEY uniq_user_tx (user_address, tx_hash)
-);
-
--- 插入初始用户余额记录
+echo "Applying migrations in database ${MYSQL_DB}..."
+
+MIGRATIONS_DIR="$(cd "$(dirname "$0")" && pwd)/migrations"
+MYSQL_EXEC=(docker exec -i "${CONTAINER_NAME}" mysql -u"${MYSQL_USER}" -p"${MYSQL_PASSWORD}" "${MYSQL_DB}")
+
+# 与 backend/migrate.py 使用同一张版本表，之后可直接用 migrate.py 执行新增的迁移
+"${MYSQL_EXEC[@]}" -e "CREATE TABLE IF NOT EXISTS schema_migrations (version VARCHAR(64) PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+for file in "${MIGRATIONS_DIR}"/*.sql; do
+  version="$(basename "${file}" | cut -d_ -f1)"
+  echo "  -> $(basename "${file}")"
+  "${MYSQL_EXEC[@]}" < "${file}"
+  "${MYSQL_EXEC[@]}" -e "INSERT INTO schema_migrations (version) VALUES ('${version}')"
+done
+
+# 插入初始用户余额记录
+"${MYSQL_EXEC[@]}" << 'SQL'
 INSERT INTO user_balances (user_address, balance) 
 VALUES ('0x97EC65A46a33a11727e430393B57010909f4bb4D', 0) 
 ON DUPLICATE KEY UPDATE balance = 0;